@@ -0,0 +1,255 @@
+import os
+import threading
+import time
+
+import pandas as pd
+import pyarrow.dataset as ds
+import shared  # noqa: F401
+from arrow_io import arrow_path, read_arrow, write_arrow
+from figures import CategoryTotals, species
+from pandas import DataFrame
+
+TIME_COLUMN = "Starttidspunkt"
+VESSEL_COLUMN = "Radiokallesignal (ERS)"
+AREA_COLUMN = "Hovedområde start"
+
+# Columns the figures aggregate over, and the columns they sum
+DIMENSIONS = ["year", "month", VESSEL_COLUMN, AREA_COLUMN]
+MEASURES = ["Rundvekt"] + species
+COLUMNS = [TIME_COLUMN, VESSEL_COLUMN, AREA_COLUMN] + MEASURES
+
+# Seconds a partition must be unchanged before it is loaded by a refresh
+REFRESH_SETTLE = 5.0
+
+
+def _list_partitions(path: str) -> list[str]:
+    """
+    Lists the data files of a dataset. A file is its own single partition,
+    while a directory is read as a partitioned dataset of csv, parquet or
+    Arrow files.
+    Combined files and files starting with "_" or "." are skipped, and so are
+    Arrow files next to a csv file, as the csv partition is read from them.
+    """
+    if not os.path.isdir(path):
+        return [path]
+
+    partitions = []
+    for folder_name, _, file_names in os.walk(path):
+        for filename in file_names:
+            if filename.startswith(("_", ".", "combined")):
+                continue
+            if filename.endswith((".csv", ".parquet")):
+                partitions.append(os.path.join(folder_name, filename))
+            elif filename.endswith(".arrow"):
+                csv_name = f"{os.path.splitext(filename)[0]}.csv"
+                if csv_name not in file_names:
+                    partitions.append(os.path.join(folder_name, filename))
+    return sorted(partitions)
+
+
+def _arrow_sibling(csv_path: str) -> str | None:
+    """
+    Returns the Arrow file written next to a csv file by the processing
+    scripts, or None if there is none or it is older than the csv file.
+    """
+    path = arrow_path(csv_path)
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(csv_path):
+        return path
+    return None
+
+
+def read_dca(path: str, columns: list[str] | None = COLUMNS) -> DataFrame:
+    """
+    Reads processed DCA data from a csv file, a parquet file, an Arrow file
+    or a directory of partitions. Csv files with an up to date Arrow file
+    next to them are memory mapped from the Arrow file instead. Only the
+    given columns are read, pass None to read every column.
+    """
+    return read_partitions(_list_partitions(path), columns)
+
+
+def read_partitions(
+    partitions: list[str], columns: list[str] | None = COLUMNS
+) -> DataFrame:
+    """
+    Reads and combines DCA data files, see read_dca.
+    """
+    parquet_files = [p for p in partitions if p.endswith(".parquet")]
+    csv_files = [p for p in partitions if p.endswith(".csv")]
+    arrow_files = [p for p in partitions if p.endswith(".arrow")]
+
+    frames = []
+    if parquet_files:
+        table = ds.dataset(parquet_files, format="parquet").to_table(columns=columns)
+        frames.append(table.to_pandas())
+    for csv_file in csv_files:
+        arrow_file = _arrow_sibling(csv_file)
+        if arrow_file is not None:
+            frames.append(read_arrow(arrow_file, columns))
+        else:
+            frames.append(pd.read_csv(csv_file, usecols=columns))
+    for arrow_file in arrow_files:
+        frames.append(read_arrow(arrow_file, columns))
+
+    df = pd.concat(frames, ignore_index=True)
+    df[TIME_COLUMN] = pd.to_datetime(df[TIME_COLUMN])
+    return df
+
+
+def summarize(df: DataFrame) -> DataFrame:
+    """
+    Aggregates DCA data to summed weights per year, month, vessel and area.
+    The result is small enough to answer every figure of the overview page.
+    """
+    df = df.assign(
+        year=df[TIME_COLUMN].dt.year,
+        month=df[TIME_COLUMN].dt.month,
+    )
+    return df.groupby(DIMENSIONS, as_index=False, dropna=False)[MEASURES].sum()
+
+
+def merge_summaries(summaries: list[DataFrame]) -> DataFrame:
+    """
+    Merges summaries of different partitions by adding their sums.
+    """
+    return (
+        pd.concat(summaries, ignore_index=True)
+        .groupby(DIMENSIONS, as_index=False, dropna=False)[MEASURES]
+        .sum()
+    )
+
+
+def summary_path(path: str) -> str:
+    """
+    Returns the path of the cached summary for a dataset.
+    """
+    if os.path.isdir(path):
+        return os.path.join(path, "_summary.arrow")
+    return f"{os.path.splitext(path)[0]}.summary.arrow"
+
+
+def write_summary(summary: DataFrame, path: str) -> None:
+    """
+    Writes a summary as an Arrow file that can be memory mapped, see
+    arrow_io.write_arrow.
+    """
+    write_arrow(summary, path)
+
+
+def read_summary(path: str) -> DataFrame:
+    """
+    Memory maps a summary written by write_summary.
+    """
+    return read_arrow(path)
+
+
+def _store_summary(summary: DataFrame, path: str) -> DataFrame:
+    """
+    Writes the summary of a dataset to its cache, and returns the
+    memory mapped cache.
+    """
+    try:
+        write_summary(summary, summary_path(path))
+    except OSError:
+        # The data location may be read only, the summary is then
+        # recomputed on the next start
+        return summary
+    return read_summary(summary_path(path))
+
+
+def load_summary(path: str) -> DataFrame:
+    """
+    Loads the summary of a dataset. The summary is read from cache if it is
+    newer than all partitions of the dataset, otherwise it is computed and
+    the cache is updated.
+    """
+    cache = summary_path(path)
+    source_mtime = max(os.path.getmtime(p) for p in _list_partitions(path))
+    if not os.path.exists(cache) or os.path.getmtime(cache) < source_mtime:
+        return _store_summary(summarize(read_dca(path)), path)
+    return read_summary(cache)
+
+
+def _partition_mtimes(path: str) -> dict[str, float]:
+    return {p: os.path.getmtime(p) for p in _list_partitions(path)}
+
+
+class DcaStore:
+    """
+    Holds the DCA data used by the webapp.
+
+    The summary is loaded on creation and is used to serve the overview
+    figures, with the totals per category of the pie chart computed from
+    it. Only the summary is kept in memory, the detailed data is not read
+    by the app.
+
+    New and changed partitions are loaded with refresh, or periodically
+    in a background thread started with watch. The new summary replaces
+    the old one in a single assignment, so callbacks always see either
+    the old or the new summary. Only the summary is refreshed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._mtimes = _partition_mtimes(path)
+        self.summary = load_summary(path)
+        self.totals = CategoryTotals(self.summary)
+        # Increased whenever the summary changes
+        self.version = 0
+        self._refresh_lock = threading.Lock()
+        self._watch_thread: threading.Thread | None = None
+
+    def refresh(self) -> bool:
+        """
+        Loads partitions added or changed since the last load. Partitions
+        modified in the last REFRESH_SETTLE seconds are left for the next
+        refresh, as they may still be written.
+
+        The sums of new partitions are added to the summary, so only the new
+        partitions are read. If a partition is changed or removed, the summary
+        is computed again from all partitions. Returns True if the summary
+        was replaced.
+        """
+        with self._refresh_lock:
+            mtimes = _partition_mtimes(self.path)
+            now = time.time()
+            if any(now - mtime < REFRESH_SETTLE for mtime in mtimes.values()):
+                return False
+            new = [p for p in mtimes if p not in self._mtimes]
+            changed = [p for p in self._mtimes if mtimes.get(p) != self._mtimes[p]]
+            if not new and not changed:
+                return False
+
+            if changed or not os.path.isdir(self.path):
+                summary = summarize(read_dca(self.path))
+            else:
+                added = summarize(read_partitions(new))
+                summary = merge_summaries([self.summary, added])
+            summary = _store_summary(summary, self.path)
+            totals = CategoryTotals(summary)
+
+            self.totals = totals
+            self.summary = summary
+            self._mtimes = mtimes
+            self.version += 1
+            return True
+
+    def watch(self, interval: float) -> None:
+        """
+        Starts a background thread that calls refresh every interval seconds.
+        Errors while refreshing are printed, and the old summary is kept.
+        """
+        if self._watch_thread is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    if self.refresh():
+                        print(f"Loaded new DCA data, version {self.version}")
+                except Exception as e:
+                    print(f"Refreshing DCA data failed: {e!r}")
+
+        self._watch_thread = threading.Thread(target=run, daemon=True)
+        self._watch_thread.start()
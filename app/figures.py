@@ -1,5 +1,8 @@
+import numpy as np
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
+from metrics import span
 from pandas import DataFrame
 from plotly.graph_objs import Figure
 
@@ -21,103 +24,234 @@ species = [
     "ANDRE",
 ]
 
+# Number of points above which line charts are rendered with WebGL
+WEBGL_THRESHOLD = 1000
+
 
 def fig_species_weight(
     df: DataFrame, interval: str = "year", year_n: int | None = None
 ) -> Figure:
-    filtered_df = df
-    if interval == "month":
-        filtered_df = filtered_df[filtered_df["year"] == year_n]
-
-    filtered_df = filtered_df.melt(
-        id_vars=[interval],
-        var_name="species",
-        value_name="weight",
-        value_vars=species,
-    )
-    filtered_df = filtered_df.groupby([interval, "species"], as_index=False).sum()
-    fig = px.line(
-        filtered_df, x=interval, y="weight", color="species", symbol="species"
-    )
+    with span("aggregate"):
+        filtered_df = df
+        if interval == "month":
+            filtered_df = filtered_df[filtered_df["year"] == year_n]
+
+        filtered_df = filtered_df.melt(
+            id_vars=[interval],
+            var_name="species",
+            value_name="weight",
+            value_vars=species,
+        )
+        filtered_df = filtered_df.groupby([interval, "species"], as_index=False).sum()
+    with span("plot"):
+        fig = px.line(
+            filtered_df, x=interval, y="weight", color="species", symbol="species"
+        )
     return fig
 
 
 def fig_vessel_catch(
-    df: DataFrame, interval: str = "year", year_n: int | None = None
+    df: DataFrame,
+    interval: str = "year",
+    year_n: int | None = None,
+    top_n: int | None = 10,
+    search: str | None = None,
 ) -> Figure:
-    filtered_df = df
-    if interval == "month":
-        filtered_df = filtered_df[filtered_df["year"] == year_n]
-
-    filtered_df = filtered_df[[interval, "Radiokallesignal (ERS)", "Rundvekt"]]
-
-    filtered_df = filtered_df.groupby(
-        [interval, "Radiokallesignal (ERS)"], as_index=False
-    ).sum()
-    fig = px.line(
-        filtered_df,
-        x=interval,
-        y="Rundvekt",
-        color="Radiokallesignal (ERS)",
-        symbol="Radiokallesignal (ERS)",
-    )
+    """
+    Line chart of catch over time for the top_n vessels with the largest
+    total catch, and the remaining vessels summed as a single series.
+    The search string limits the chart to vessels whose call sign
+    contains it.
+    """
+    with span("aggregate"):
+        vessel = "Radiokallesignal (ERS)"
+        filtered_df = df
+        if interval == "month":
+            filtered_df = filtered_df[filtered_df["year"] == year_n]
+        if search:
+            filtered_df = filtered_df[
+                filtered_df[vessel].str.contains(
+                    search.strip(), case=False, regex=False, na=False
+                )
+            ]
+
+        filtered_df = filtered_df.groupby([interval, vessel], as_index=False)[
+            "Rundvekt"
+        ].sum()
+
+        # Reduce to the top vessels and an aggregated series of the rest
+        if top_n is None:
+            top_n = 10
+        totals = filtered_df.groupby(vessel)["Rundvekt"].sum()
+        top_vessels = totals.nlargest(top_n).index
+        is_top = filtered_df[vessel].isin(top_vessels)
+        others = (
+            filtered_df[~is_top].groupby(interval, as_index=False)["Rundvekt"].sum()
+        )
+        filtered_df = filtered_df[is_top]
+
+    with span("plot"):
+        n_points = len(filtered_df) + len(others)
+        scatter = go.Scattergl if n_points > WEBGL_THRESHOLD else go.Scatter
+
+        fig = go.Figure()
+        for call_sign in top_vessels:
+            vessel_df = filtered_df[filtered_df[vessel] == call_sign]
+            fig.add_trace(
+                scatter(
+                    x=vessel_df[interval],
+                    y=vessel_df["Rundvekt"],
+                    mode="lines+markers",
+                    name=call_sign,
+                )
+            )
+        if len(others) > 0:
+            fig.add_trace(
+                scatter(
+                    x=others[interval],
+                    y=others["Rundvekt"],
+                    mode="lines+markers",
+                    name=f"Others ({len(totals) - len(top_vessels)} vessels)",
+                    line={"color": "gray", "dash": "dash"},
+                )
+            )
+        fig.update_layout(
+            xaxis_title=interval, yaxis_title="Rundvekt", legend_title_text=vessel
+        )
     return fig
 
 
 def fig_area_catch(
     df: DataFrame, interval: str = "year", year_n: int | None = None
 ) -> Figure:
-    filtered_df = df
-    if interval == "month" and year_n is not None:
-        filtered_df = filtered_df[filtered_df["year"] == year_n]
-
-    filtered_df = filtered_df[[interval, "Hovedområde start", "Rundvekt"]]
-    filtered_df = filtered_df.groupby(
-        [interval, "Hovedområde start"], as_index=False
-    ).sum()
-    fig = px.line(
-        filtered_df,
-        x=interval,
-        y="Rundvekt",
-        color="Hovedområde start",
-        symbol="Hovedområde start",
-    )
+    with span("aggregate"):
+        filtered_df = df
+        if interval == "month" and year_n is not None:
+            filtered_df = filtered_df[filtered_df["year"] == year_n]
+
+        filtered_df = filtered_df[[interval, "Hovedområde start", "Rundvekt"]]
+        filtered_df = filtered_df.groupby(
+            [interval, "Hovedområde start"], as_index=False
+        ).sum()
+    with span("plot"):
+        fig = px.line(
+            filtered_df,
+            x=interval,
+            y="Rundvekt",
+            color="Hovedområde start",
+            symbol="Hovedområde start",
+        )
     return fig
 
 
-def fig_pie_chart(df: DataFrame, category: str, top_n: int = 5) -> Figure:
+class CategoryTotals:
     """
-    Categories: (vessels, species, area)
+    Total catch per category value (vessel, area or species), precomputed
+    from the summary for every year and month, so the top values of any
+    period are found without aggregating the summary again.
+
+    Totals are kept per (year, month), per year, per month and for all
+    data. A query only selects one of these rows, and finds its top values
+    by partial selection.
     """
-    category_map = {
+
+    # Summary column of each category, species are columns of their own
+    COLUMNS = {
         "vessels": "Radiokallesignal (ERS)",
         "area": "Hovedområde start",
     }
-    if category in category_map:
-        category = category_map[category]
 
-    filtered_df = df
-    if category == "species":
-        filtered_df = filtered_df[species]
-        filtered_df = filtered_df.melt(
-            var_name="species",
-            value_name="Rundvekt",
-            value_vars=species,
-        )
-        filtered_df = filtered_df.replace("ANDRE", "Arter uten navn")
+    def __init__(self, summary: DataFrame):
+        self._totals = {}
+        for category in ["vessels", "species", "area"]:
+            if category == "species":
+                by_period = summary.groupby(["year", "month"])[species].sum()
+                by_period = by_period.rename(columns={"ANDRE": "Arter uten navn"})
+            else:
+                by_period = (
+                    summary.groupby(["year", "month", self.COLUMNS[category]])[
+                        "Rundvekt"
+                    ]
+                    .sum()
+                    .unstack(fill_value=0)
+                )
+            self._totals[category] = {
+                "period": by_period,
+                "year": by_period.groupby(level="year").sum(),
+                "month": by_period.groupby(level="month").sum(),
+                "all": by_period.sum().to_frame().T,
+            }
+
+    def totals(
+        self, category: str, year: int | None = None, month: int | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the names of a category and their total catch in a year,
+        a month of every year, a month of a year, or in all data if year
+        and month are None. Names without catch in the period are left out.
+        """
+        totals = self._totals[category]
+        if year is not None and month is not None:
+            table, key = totals["period"], (year, month)
+        elif year is not None:
+            table, key = totals["year"], year
+        elif month is not None:
+            table, key = totals["month"], month
+        else:
+            table, key = totals["all"], 0
+        if key not in table.index:
+            return np.array([], dtype=object), np.array([])
+
+        names = table.columns.to_numpy(dtype=object)
+        values = table.loc[key].to_numpy(dtype=float)
+        has_catch = values != 0
+        return names[has_catch], values[has_catch]
+
+    def top_n(
+        self,
+        category: str,
+        top_n: int,
+        year: int | None = None,
+        month: int | None = None,
+    ) -> DataFrame:
+        """
+        Returns the top_n names of a category with the largest total catch
+        in descending order, and the rest summed as "ANDRE". With top_n 0
+        or less every name is part of the rest.
+        """
+        names, values = self.totals(category, year, month)
+        top_n = max(top_n, 0)
+        if top_n == 0:
+            top = np.array([], dtype=np.intp)
+        elif top_n < len(values):
+            top = np.argpartition(values, -top_n)[-top_n:]
+        else:
+            top = np.arange(len(values))
+        top = top[np.argsort(values[top])[::-1]]
 
-    else:
-        filtered_df = filtered_df[[category, "Rundvekt"]]
+        result_names = names[top]
+        result_values = values[top]
+        if len(top) < len(values):
+            rest = np.ones(len(values), dtype=bool)
+            rest[top] = False
+            result_names = np.append(result_names, "ANDRE")
+            result_values = np.append(result_values, values[rest].sum())
+        return DataFrame({category: result_names, "Rundvekt": result_values})
 
-    filtered_df = filtered_df.groupby(category, as_index=False).sum()
 
-    result = filtered_df.nlargest(top_n, columns="Rundvekt", keep="all")
-    result.loc[len(result)] = [
-        "ANDRE",
-        filtered_df.loc[
-            ~filtered_df[category].isin(result[category]), "Rundvekt"
-        ].sum(),
-    ]
+def fig_pie_chart(
+    totals: CategoryTotals,
+    category: str,
+    top_n: int = 5,
+    year: int | None = None,
+    month: int | None = None,
+) -> Figure:
+    """
+    Categories: (vessels, species, area)
+    """
+    with span("aggregate"):
+        result = totals.top_n(category, top_n, year, month)
 
-    fig = px.pie(result, names=category, values="Rundvekt")
+    with span("plot"):
+        fig = px.pie(result, names=category, values="Rundvekt")
     return fig
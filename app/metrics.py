@@ -0,0 +1,288 @@
+import cProfile
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+from functools import wraps
+
+import numpy as np
+from flask import Flask, g, has_request_context, jsonify, request
+
+try:
+    from pyinstrument import Profiler
+except ImportError:
+    Profiler = None
+
+# Number of recent calls per callback used for the latency percentiles
+WINDOW = 1000
+
+_local = threading.local()
+
+
+@contextmanager
+def span(name: str):
+    """
+    Measures the time spent in a block of code, and adds it to the
+    callback that is currently running on this thread. Does nothing
+    outside of an instrumented callback.
+    """
+    record = getattr(_local, "record", None)
+    if record is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans = record["spans"]
+        spans[name] = spans.get(name, 0.0) + time.perf_counter() - start
+
+
+class FigureCache:
+    """
+    Least recently used cache of callback results. Entries are keyed by the
+    callback arguments and a data version, so results are not reused after
+    the data changes.
+    """
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the cached result for key, or None if it is not cached.
+        """
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+class Metrics:
+    """
+    Records wall time, time spent in spans, payload size and cache hits
+    for the callbacks of the app.
+
+    Callbacks are instrumented with instrument, and measurements are
+    served as JSON on /metrics once registered with register. Each
+    process serving the app keeps its own measurements.
+
+    Args:
+        log_path (str) : Optional file where every call is logged as a JSON line.
+        profile_dir (str) : Optional directory for profiles of the slowest calls.
+        profile_sample (float) : Fraction of calls that are profiled.
+        profile_keep (int) : Number of slowest profiles kept per callback.
+    """
+
+    def __init__(
+        self,
+        log_path: str | None = None,
+        profile_dir: str | None = None,
+        profile_sample: float = 0.0,
+        profile_keep: int = 5,
+    ):
+        self.log_path = log_path
+        self.profile_dir = profile_dir
+        self.profile_sample = profile_sample if profile_dir is not None else 0.0
+        self.profile_keep = profile_keep
+        self._calls = defaultdict(lambda: deque(maxlen=WINDOW))
+        self._counts = defaultdict(lambda: defaultdict(int))
+        self._profiles = defaultdict(list)
+        self._lock = threading.Lock()
+        if profile_dir is not None:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    @classmethod
+    def from_environment(cls) -> "Metrics":
+        """
+        Creates metrics configured by ERS_APP_METRICS_LOG, ERS_APP_PROFILE_DIR,
+        ERS_APP_PROFILE_SAMPLE and ERS_APP_PROFILE_KEEP.
+        """
+        return cls(
+            log_path=os.environ.get("ERS_APP_METRICS_LOG"),
+            profile_dir=os.environ.get("ERS_APP_PROFILE_DIR"),
+            profile_sample=float(os.environ.get("ERS_APP_PROFILE_SAMPLE", "0.1")),
+            profile_keep=int(os.environ.get("ERS_APP_PROFILE_KEEP", "5")),
+        )
+
+    def instrument(self, name: str, cache: FigureCache | None = None, version=None):
+        """
+        Decorator for callbacks. The name should be the output of the
+        callback, like "pie_top_n_graph.figure", so the payload size
+        can be matched to it.
+
+        Args:
+            name (str) : Name of the callback.
+            cache (FigureCache) : Optional cache for the callback results.
+            version (func) : Returns the current data version, used in cache keys.
+        """
+
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args):
+                record = {"callback": name, "spans": {}, "cache_hit": None}
+                key = None
+                if cache is not None:
+                    key = (name, version() if version is not None else None, args)
+                    result = cache.get(key)
+                    record["cache_hit"] = result is not None
+
+                start = time.perf_counter()
+                if record["cache_hit"] is not True:
+                    _local.record = record
+                    try:
+                        result = self._call(name, record, function, args)
+                    finally:
+                        _local.record = None
+                    if cache is not None:
+                        cache.put(key, result)
+                record["wall"] = time.perf_counter() - start
+
+                if has_request_context():
+                    # Finished in after_request, when the payload size is known
+                    g.metrics_record = record
+                else:
+                    self._finish(record)
+                return result
+
+            return wrapper
+
+        return decorator
+
+    def _call(self, name: str, record: dict, function, args):
+        """
+        Runs a callback, with a profiler for a sample of the calls.
+        """
+        if self.profile_sample <= 0 or random.random() >= self.profile_sample:
+            return function(*args)
+
+        if Profiler is not None:
+            profiler = Profiler()
+            profiler.start()
+            try:
+                return function(*args)
+            finally:
+                profiler.stop()
+                record["profile"] = (profiler, "html")
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(function, *args)
+        finally:
+            record["profile"] = (profiler, "prof")
+
+    def _save_profile(self, record: dict) -> None:
+        """
+        Stores the profile of a call if it is among the slowest
+        profiled calls of its callback.
+        """
+        profiler, extension = record.pop("profile")
+        wall_ms = record["wall"] * 1000
+        with self._lock:
+            kept = self._profiles[record["callback"]]
+            if len(kept) >= self.profile_keep and wall_ms <= kept[0][0]:
+                return
+            path = os.path.join(
+                self.profile_dir,
+                f"{record['callback']}_{int(wall_ms)}ms_{time.time_ns()}.{extension}",
+            )
+            kept.append((wall_ms, path))
+            kept.sort()
+            while len(kept) > self.profile_keep:
+                _, removed = kept.pop(0)
+                if os.path.exists(removed):
+                    os.remove(removed)
+
+        if extension == "html":
+            with open(path, "w") as f:
+                f.write(profiler.output_html())
+        else:
+            profiler.dump_stats(path)
+
+    def _finish(self, record: dict) -> None:
+        """
+        Adds a finished call to the measurements.
+        """
+        if "profile" in record:
+            self._save_profile(record)
+        with self._lock:
+            self._calls[record["callback"]].append(record)
+            counts = self._counts[record["callback"]]
+            counts["calls"] += 1
+            if record["cache_hit"] is True:
+                counts["cache_hits"] += 1
+            elif record["cache_hit"] is False:
+                counts["cache_misses"] += 1
+
+        if self.log_path is not None:
+            line = json.dumps({"time": time.time(), **record})
+            with self._lock, open(self.log_path, "a") as f:
+                f.write(line + "\n")
+
+    def summary(self) -> dict:
+        """
+        Returns the measurements of every callback. Times are in milliseconds
+        and payloads in bytes, taken over the most recent calls. Span times
+        are taken over the calls that were not served from the cache.
+        """
+        result = {}
+        with self._lock:
+            calls = {name: list(records) for name, records in self._calls.items()}
+            counts = {name: dict(count) for name, count in self._counts.items()}
+
+        for name, records in calls.items():
+            wall = np.array([r["wall"] for r in records]) * 1000
+            # Cache hits skip aggregating and plotting, and are left out of
+            # the span times
+            computed = [r for r in records if r["cache_hit"] is not True]
+            span_names = sorted({s for r in computed for s in r["spans"]})
+            payload = [r["payload"] for r in records if "payload" in r]
+            result[name] = {
+                **counts[name],
+                "wall_ms": {
+                    "mean": wall.mean(),
+                    "p50": np.percentile(wall, 50),
+                    "p95": np.percentile(wall, 95),
+                    "max": wall.max(),
+                },
+                "span_ms": {
+                    s: np.mean([r["spans"].get(s, 0.0) for r in computed]) * 1000
+                    for s in span_names
+                },
+                "payload_bytes": {
+                    "mean": float(np.mean(payload)) if payload else None,
+                    "max": max(payload) if payload else None,
+                },
+            }
+        return result
+
+    def register(self, server: Flask) -> None:
+        """
+        Adds the /metrics endpoint to the server, and measures
+        the payload size of callback responses.
+        """
+
+        @server.after_request
+        def record_payload(response):
+            record = g.pop("metrics_record", None)
+            if record is not None:
+                if not response.direct_passthrough:
+                    record["payload"] = response.calculate_content_length()
+                self._finish(record)
+            return response
+
+        @server.route("/metrics")
+        def metrics():
+            return jsonify(self.summary())
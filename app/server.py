@@ -0,0 +1,453 @@
+import os
+from datetime import date
+
+import plotly
+from dash import Dash, Input, Output, ctx, dcc, html, no_update
+from data import DcaStore
+from figures import fig_area_catch, fig_pie_chart, fig_species_weight, fig_vessel_catch
+from flask import Flask
+from metrics import FigureCache, Metrics
+from pandas import DataFrame
+from tracks import TrackExplorer
+
+
+def generate_table(df: DataFrame, max_rows: int = 10) -> html.Table:
+    """
+    Generate a table of the given dataframe:
+
+    Arg:
+        df : A pandas dataframe
+        max_rows : Number of rows to display
+
+    Returns:
+        A html.Table of the dataframe
+
+    """
+    return html.Table(
+        [
+            html.Thead(html.Tr([html.Th(col) for col in df.columns])),
+            html.Tbody(
+                [
+                    html.Tr([html.Td(df.iloc[i][col]) for col in df.columns])
+                    for i in range(min(len(df), max_rows))
+                ]
+            ),
+        ]
+    )
+
+
+def generate_interval_menu(id: str, year_min: int, year_max: int) -> html.Div:
+    """
+    Creates a menu for an interval menu:
+
+    Args:
+        id (str) : container id
+        year_min (int) : first year of the year slider
+        year_max (int) : last year of the year slider
+
+    Returns:
+        A html.Div of the interval menu
+    """
+    return html.Div(
+        [
+            dcc.RadioItems(
+                options={"year": "Yearly", "month": "Monthly"},
+                value="year",
+                id=f"{id}_interval_radio",
+            ),
+            dcc.Slider(
+                id=f"{id}_interval_slider",
+                min=year_min,
+                max=year_max,
+                step=1,
+                disabled=True,
+                marks={i: f"{i}" for i in range(year_min, year_max + 1)},
+            ),
+        ]
+    )
+
+
+def generate_pie_chart_menu(id: str, year_min: int, year_max: int) -> html.Div:
+    """
+    Creates a menu for the pie chart, with the category, the number
+    of values and an optional year and month.
+
+    Args:
+        id (str) : container id
+        year_min (int) : first year of the year filter
+        year_max (int) : last year of the year filter
+
+    Returns:
+        A html.Div of the pie chart menu
+    """
+    return html.Div(
+        [
+            dcc.RadioItems(
+                options=["vessels", "species", "area"],
+                value="vessels",
+                id=f"{id}_category_radio",
+            ),
+            dcc.Input(
+                type="number",
+                value=5,
+                min=2,
+                id=f"{id}_number_input",
+            ),
+            dcc.Dropdown(
+                options=list(range(year_min, year_max + 1)),
+                placeholder="All years",
+                id=f"{id}_year_dropdown",
+            ),
+            dcc.Dropdown(
+                options=list(range(1, 13)),
+                placeholder="All months",
+                id=f"{id}_month_dropdown",
+            ),
+        ]
+    )
+
+
+def generate_vessel_menu(id: str, year_min: int, year_max: int) -> html.Div:
+    """
+    Creates a menu for the vessel chart, an interval menu
+    with inputs for the number of vessels and a vessel search.
+
+    Args:
+        id (str) : container id
+        year_min (int) : first year of the year slider
+        year_max (int) : last year of the year slider
+
+    Returns:
+        A html.Div of the vessel menu
+    """
+    return html.Div(
+        [
+            generate_interval_menu(id=id, year_min=year_min, year_max=year_max),
+            dcc.Input(
+                type="number",
+                value=10,
+                min=1,
+                id=f"{id}_top_n_input",
+            ),
+            dcc.Input(
+                type="text",
+                placeholder="Search call sign",
+                debounce=True,
+                id=f"{id}_search_input",
+            ),
+        ]
+    )
+
+
+def create_container(
+    id: str,
+    title: str,
+    graph_type: str,
+    df: DataFrame,
+    graph_function=None,
+    **kwargs,
+) -> html.Div:
+    """
+    Creates a container with a given graph type and graph function.
+
+    Args:
+        id (str) : container id.
+        title (str) : container title.
+        graph_type (str) : Type of graph to use. (interval, vessel, pie)
+        df (DataFrame) : Summary data used for the menu and the initial figure.
+        graph_function (func) : Graphing function to generate figure.
+
+    Returns:
+        A html.Div containing graph and menu
+    """
+    year_min = int(df["year"].min())
+    year_max = int(df["year"].max())
+    if graph_type == "interval":
+        menu = generate_interval_menu(id=id, year_min=year_min, year_max=year_max)
+    elif graph_type == "vessel":
+        menu = generate_vessel_menu(id=id, year_min=year_min, year_max=year_max)
+    else:
+        menu = generate_pie_chart_menu(id=id, year_min=year_min, year_max=year_max)
+    container = html.Div(
+        [
+            html.H2(title),
+            menu,
+            (
+                dcc.Graph(id=f"{id}_graph", figure=graph_function(df, **kwargs))
+                if graph_function is not None
+                else dcc.Graph(id=f"{id}_graph")
+            ),
+        ]
+    )
+    return container
+
+
+def create_track_container(id: str) -> html.Div:
+    """
+    Creates a container for the AIS track explorer.
+
+    Args:
+        id (str) : container id
+
+    Returns:
+        A html.Div containing the track graph and menu
+    """
+    return html.Div(
+        [
+            html.H2("AIS track explorer"),
+            html.Div(
+                [
+                    dcc.Input(
+                        type="text",
+                        placeholder="mmsi or call sign",
+                        debounce=True,
+                        id=f"{id}_vessel_input",
+                    ),
+                    dcc.DatePickerRange(
+                        id=f"{id}_date_range", display_format="YYYY-MM-DD"
+                    ),
+                ]
+            ),
+            dcc.Graph(id=f"{id}_graph", style={"height": "80vh"}),
+        ]
+    )
+
+
+def create_layout(df: DataFrame, with_tracks: bool = False) -> html.Div:
+    """
+    Creates the layout of the app from the summary data.
+    The AIS track explorer is added as a second tab if with_tracks is set.
+    """
+    # Figures are drawn by their callbacks when the page loads, which
+    # measures them and serves them from the figure cache
+    catch_page = html.Div(
+        children=[
+            # generate_table(df),
+            create_container(
+                id="species_over_time",
+                title="Species weight over time",
+                graph_type="interval",
+                df=df,
+            ),
+            create_container(
+                id="vessel_catch",
+                title="Vessels catch over time",
+                graph_type="vessel",
+                df=df,
+            ),
+            create_container(
+                id="area_catch",
+                title="Area catch over time",
+                graph_type="interval",
+                df=df,
+            ),
+            create_container(
+                id="pie_top_n",
+                title="Top N pie chart",
+                graph_type="pie",
+                df=df,
+            ),
+        ],
+    )
+    if not with_tracks:
+        return html.Div(children=[catch_page])
+
+    return html.Div(
+        children=[
+            dcc.Tabs(
+                [
+                    dcc.Tab(label="Catch", children=[catch_page]),
+                    dcc.Tab(
+                        label="AIS tracks",
+                        children=[create_track_container(id="ais_track")],
+                    ),
+                ]
+            )
+        ]
+    )
+
+
+####################
+# Callback functions
+####################
+
+
+def set_graph_interval(
+    app: Dash,
+    store: DcaStore,
+    metrics: Metrics,
+    cache: FigureCache,
+    container_id: str,
+    graph_function,
+    extra_inputs: list[str] | None = None,
+):
+    """
+    Connects the interval menu of a container to its graph.
+    Values of extra_inputs are passed on as additional arguments
+    to the graph function.
+    """
+    extra_inputs = extra_inputs or []
+
+    @app.callback(
+        Output(f"{container_id}_graph", "figure"),
+        [
+            Input(f"{container_id}_interval_radio", "value"),
+            Input(f"{container_id}_interval_slider", "value"),
+        ]
+        + [Input(f"{container_id}_{name}", "value") for name in extra_inputs],
+    )
+    @metrics.instrument(
+        f"{container_id}_graph.figure", cache, version=lambda: store.version
+    )
+    def set_graph_year(interval, year, *extra):
+        return graph_function(store.summary, interval, year, *extra)
+
+    @app.callback(
+        Output(f"{container_id}_interval_slider", "disabled"),
+        Input(f"{container_id}_interval_radio", "value"),
+    )
+    def toggle_year_slider(interval):
+        if interval == "year":
+            return True
+        elif interval == "month":
+            return False
+
+
+def register_callbacks(
+    app: Dash, store: DcaStore, metrics: Metrics, cache: FigureCache
+) -> None:
+    """
+    Registers all callbacks of the app.
+    """
+
+    @app.callback(
+        Output("pie_top_n_graph", "figure"),
+        [
+            Input("pie_top_n_category_radio", "value"),
+            Input("pie_top_n_number_input", "value"),
+            Input("pie_top_n_year_dropdown", "value"),
+            Input("pie_top_n_month_dropdown", "value"),
+        ],
+    )
+    @metrics.instrument("pie_top_n_graph.figure", cache, version=lambda: store.version)
+    def update_pie_chart(category, number, year, month):
+        if type(number) is not int:
+            return plotly.graph_objs.Figure()
+        else:
+            return fig_pie_chart(store.totals, category, number, year, month)
+
+    set_graph_interval(
+        app, store, metrics, cache, "species_over_time", fig_species_weight
+    )
+    set_graph_interval(
+        app,
+        store,
+        metrics,
+        cache,
+        "vessel_catch",
+        fig_vessel_catch,
+        ["top_n_input", "search_input"],
+    )
+    set_graph_interval(app, store, metrics, cache, "area_catch", fig_area_catch)
+
+
+def register_track_callbacks(
+    app: Dash, explorer: TrackExplorer, metrics: Metrics
+) -> None:
+    """
+    Registers the callbacks of the AIS track explorer.
+    """
+
+    @app.callback(
+        Output("ais_track_graph", "figure"),
+        [
+            Input("ais_track_vessel_input", "value"),
+            Input("ais_track_date_range", "start_date"),
+            Input("ais_track_date_range", "end_date"),
+            Input("ais_track_graph", "relayoutData"),
+        ],
+    )
+    @metrics.instrument("ais_track_graph.figure")
+    def update_track(vessel, start_date, end_date, relayout):
+        if not vessel or start_date is None or end_date is None:
+            return plotly.graph_objs.Figure()
+
+        # Decimate for the current zoom when the view of the graph changes
+        x_range = y_range = None
+        if ctx.triggered_id == "ais_track_graph" and relayout is not None:
+            if "xaxis.range[0]" in relayout and "yaxis.range[0]" in relayout:
+                x_range = [relayout["xaxis.range[0]"], relayout["xaxis.range[1]"]]
+                y_range = [relayout["yaxis.range[0]"], relayout["yaxis.range[1]"]]
+            elif not relayout.get("xaxis.autorange"):
+                return no_update
+
+        return explorer.figure(
+            vessel,
+            date.fromisoformat(start_date[:10]),
+            date.fromisoformat(end_date[:10]),
+            x_range,
+            y_range,
+        )
+
+
+def create_app(
+    path_dca: str | None = None,
+    path_ais: str | None = None,
+    path_mmsi: str | None = None,
+    refresh_interval: float | None = None,
+) -> Dash:
+    """
+    Creates the app. Arguments that are not given are read from
+    environment variables:
+
+    Args:
+        path_dca (str) : Path to processed DCA data. (ERS_APP_DCA_PATH)
+        path_ais (str) : Path to marked AIS data, enables the AIS track
+            explorer. (ERS_APP_AIS_PATH)
+        path_mmsi (str) : Path to MMSI data in xlsx or csv format, used to find
+            vessels by call sign in the track explorer. (ERS_APP_MMSI_PATH)
+        refresh_interval (float) : Seconds between checks for new or changed
+            DCA partitions, 0 disables the checks.
+            (ERS_APP_REFRESH_INTERVAL, defaults to 60)
+
+    Returns:
+        The Dash app
+    """
+    if path_dca is None:
+        path_dca = os.environ.get("ERS_APP_DCA_PATH")
+    if path_dca is None:
+        raise ValueError("No DCA data given, set ERS_APP_DCA_PATH.")
+    if path_ais is None:
+        path_ais = os.environ.get("ERS_APP_AIS_PATH")
+    if path_mmsi is None:
+        path_mmsi = os.environ.get("ERS_APP_MMSI_PATH")
+    if refresh_interval is None:
+        refresh_interval = float(os.environ.get("ERS_APP_REFRESH_INTERVAL", "60"))
+
+    # Figures are served from a small summary of the data, that is
+    # memory mapped and shared between all processes serving the app
+    store = DcaStore(path_dca)
+    if refresh_interval > 0:
+        store.watch(refresh_interval)
+
+    app = Dash(__name__)
+    app.config.suppress_callback_exceptions = True
+    # The layout is created on every page load, so the menus
+    # include the years added by a refresh
+    app.layout = lambda: create_layout(store.summary, with_tracks=path_ais is not None)
+
+    # Callback measurements are served on /metrics
+    metrics = Metrics.from_environment()
+    metrics.register(app.server)
+    register_callbacks(app, store, metrics, FigureCache())
+    if path_ais is not None:
+        register_track_callbacks(app, TrackExplorer(path_ais, path_mmsi), metrics)
+    return app
+
+
+def create_server() -> Flask:
+    """
+    Creates the app and returns its WSGI server, configured
+    through environment variables. Used by WSGI servers like gunicorn.
+    """
+    return create_app().server
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# The app shares modules with the processing scripts, like reading Arrow
+# files and the MMSI table. Importing this module makes them importable.
+SCRIPT_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"
+)
+if SCRIPT_DIR not in sys.path:
+    sys.path.append(SCRIPT_DIR)
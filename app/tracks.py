@@ -0,0 +1,335 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import pyarrow as pa
+import pyarrow.dataset as ds
+import shared  # noqa: F401
+from metrics import span
+from mmsi_mapping import VALID_FROM, VALID_TO, read_mmsi_mapping
+from pandas import DataFrame
+from plotly.graph_objs import Figure
+
+# Schema of the columns read from marked AIS data. Days without any
+# fishing trip have a trip_id column of only NaN, so the schema is given
+# explicitly to read all days with the same types.
+AIS_SCHEMA = pa.schema(
+    [
+        ("mmsi", pa.int64()),
+        ("date_time_utc", pa.timestamp("ns")),
+        ("lon", pa.float64()),
+        ("lat", pa.float64()),
+        ("fishing", pa.bool_()),
+        ("trip_id", pa.string()),
+    ]
+)
+
+# Upper bound of points sent to the browser for a single track
+MAX_TRACK_POINTS = 5000
+# Horizontal resolution the track is simplified for
+TRACK_RESOLUTION = 1500
+# Memory in bytes of full resolution tracks kept by each process serving
+# the app, so zooming does not read the track again
+TRACK_CACHE_BYTES = 256 * 2**20
+
+
+def _list_ais_files(path: str, start: date, end: date) -> list[str]:
+    """
+    Lists marked AIS parquet files in a directory. Files with a date
+    in their name outside of the range from start to end are skipped.
+    """
+    ais_files = []
+    for folder_name, _, file_names in os.walk(path):
+        for filename in file_names:
+            if not filename.endswith(".parquet"):
+                continue
+            match = re.search(r"\d{8}", filename)
+            if match is not None:
+                file_date = datetime.strptime(match.group(), "%Y%m%d").date()
+                if file_date < start or file_date > end:
+                    continue
+            ais_files.append(os.path.join(folder_name, filename))
+    return sorted(ais_files)
+
+
+def read_track(ais_path: str, mmsi: list[int], start: date, end: date) -> DataFrame:
+    """
+    Reads the AIS track of one or more mmsi between the start and end date.
+    Rows are filtered while reading, so only the rows of the track are loaded.
+    """
+    ais_files = _list_ais_files(ais_path, start, end)
+    if not ais_files:
+        return AIS_SCHEMA.empty_table().to_pandas()
+
+    start_time = pd.Timestamp(start)
+    end_time = pd.Timestamp(end) + pd.Timedelta(days=1)
+    dataset = ds.dataset(ais_files, format="parquet", schema=AIS_SCHEMA)
+    table = dataset.to_table(
+        filter=(
+            ds.field("mmsi").isin(mmsi)
+            & (ds.field("date_time_utc") >= start_time)
+            & (ds.field("date_time_utc") < end_time)
+        )
+    )
+    return table.to_pandas().sort_values("date_time_utc", ignore_index=True)
+
+
+class TrackCache:
+    """
+    Least recently used cache of tracks read by read_track, bounded by the
+    memory of the tracks instead of their number, as a track can be from a
+    single day or from years. Tracks larger than the cache are not cached.
+    """
+
+    def __init__(self, max_bytes: int = TRACK_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def read(
+        self, ais_path: str, mmsi: tuple[int, ...], start: date, end: date
+    ) -> DataFrame:
+        """
+        Returns the track from the cache, or reads and caches it.
+        """
+        key = (ais_path, mmsi, start, end)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+
+        track = read_track(ais_path, list(mmsi), start, end)
+        size = int(track.memory_usage(deep=True).sum())
+        if size > self.max_bytes:
+            return track
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (track, size)
+                self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+        return track
+
+
+def simplify_track(
+    x: np.ndarray, y: np.ndarray, tolerance: float, keep: np.ndarray | None = None
+) -> np.ndarray:
+    """
+    Simplifies a line with the Ramer-Douglas-Peucker algorithm.
+    Returns a boolean mask of the points to keep.
+
+    Parameters:
+    -----------
+    x, y: coordinates of the line
+    tolerance: largest distance allowed between the line and removed points
+    keep: boolean mask of points that must be kept, the line is simplified
+        separately between these points
+    """
+    n = len(x)
+    mask = np.zeros(n, dtype=bool)
+    if n < 3:
+        mask[:] = True
+        return mask
+
+    if keep is not None:
+        mask |= keep
+    mask[0] = mask[-1] = True
+    anchors = np.flatnonzero(mask)
+    stack = list(zip(anchors[:-1], anchors[1:]))
+
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        dx = x[last] - x[first]
+        dy = y[last] - y[first]
+        px = x[first + 1 : last] - x[first]
+        py = y[first + 1 : last] - y[first]
+        length = np.hypot(dx, dy)
+        if length == 0:
+            distances = np.hypot(px, py)
+        else:
+            distances = np.abs(dx * py - dy * px) / length
+        i = np.argmax(distances)
+        if distances[i] > tolerance:
+            split = first + 1 + i
+            mask[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return mask
+
+
+def decimate_track(
+    track: DataFrame,
+    x_range: list[float] | None = None,
+    y_range: list[float] | None = None,
+    max_points: int = MAX_TRACK_POINTS,
+) -> DataFrame:
+    """
+    Reduces a track to the points visible in the given ranges, simplified
+    to the resolution of the view and to at most max_points points.
+    Points where the fishing state or trip changes are kept, unless there
+    are more than max_points of them.
+    """
+    if x_range is not None and y_range is not None:
+        # Keep the neighbours of visible points, so lines leaving the
+        # view are still drawn
+        visible = (
+            track["lon"].between(*x_range).values
+            & track["lat"].between(*y_range).values
+        )
+        visible[1:] |= visible[:-1].copy()
+        visible[:-1] |= visible[1:].copy()
+        track = track[visible].reset_index(drop=True)
+    if len(track) <= max_points:
+        return track
+
+    x = track["lon"].values
+    y = track["lat"].values
+    fishing = track["fishing"].values
+    trip_codes, _ = pd.factorize(track["trip_id"])
+    changes = (fishing[1:] != fishing[:-1]) | (trip_codes[1:] != trip_codes[:-1])
+    keep = np.zeros(len(track), dtype=bool)
+    keep[1:] |= changes
+    keep[:-1] |= changes
+
+    # A stationary track has no shape to simplify
+    extent = max(np.ptp(x), np.ptp(y))
+    if extent > 0:
+        # Drop consecutive points that fall in the same cell of a grid, with
+        # cells as large as the tolerance. This is cheap and bounds the number
+        # of points left for the line simplification.
+        tolerance = extent / TRACK_RESOLUTION
+        while True:
+            cell_x = np.floor(x / tolerance)
+            cell_y = np.floor(y / tolerance)
+            new_cell = np.ones(len(x), dtype=bool)
+            new_cell[1:] = (cell_x[1:] != cell_x[:-1]) | (cell_y[1:] != cell_y[:-1])
+            new_cell |= keep
+            new_cell[-1] = True
+            if new_cell.sum() <= 4 * max_points or tolerance >= extent:
+                break
+            tolerance *= 2
+        track = track[new_cell].reset_index(drop=True)
+        x, y, keep = x[new_cell], y[new_cell], keep[new_cell]
+
+        mask = simplify_track(x, y, tolerance, keep)
+        while mask.sum() > max_points and tolerance < extent:
+            tolerance *= 2
+            mask = simplify_track(x, y, tolerance, keep)
+    else:
+        mask = keep.copy()
+        mask[[0, -1]] = True
+
+    # Points that are always kept can alone be more than max_points,
+    # the points left are then thinned evenly
+    if mask.sum() > max_points:
+        kept = np.flatnonzero(mask)
+        mask = np.zeros(len(track), dtype=bool)
+        mask[kept[np.linspace(0, len(kept) - 1, max_points).astype(int)]] = True
+    return track[mask].reset_index(drop=True)
+
+
+def fig_track(track: DataFrame) -> Figure:
+    """
+    Plots an AIS track with a line for each fishing trip,
+    and markers where the vessel is fishing.
+    """
+    fig = go.Figure()
+    trips = track["trip_id"].fillna("No trip")
+    for trip_id in trips.unique():
+        trip = track[trips == trip_id]
+        fig.add_trace(
+            go.Scattergl(
+                x=trip["lon"],
+                y=trip["lat"],
+                mode="lines",
+                name=trip_id,
+                text=trip["date_time_utc"].astype(str),
+                line={"color": "gray"} if trip_id == "No trip" else None,
+            )
+        )
+    fishing = track[track["fishing"].fillna(False).astype(bool)]
+    fig.add_trace(
+        go.Scattergl(
+            x=fishing["lon"],
+            y=fishing["lat"],
+            mode="markers",
+            name="Fishing",
+            text=fishing["date_time_utc"].astype(str),
+            marker={"color": "red", "size": 4},
+        )
+    )
+
+    mean_lat = track["lat"].mean() if len(track) > 0 else 0
+    fig.update_layout(
+        xaxis_title="lon",
+        yaxis_title="lat",
+        yaxis={"scaleanchor": "x", "scaleratio": 1 / np.cos(np.radians(mean_lat))},
+    )
+    return fig
+
+
+class TrackExplorer:
+    """
+    Reads and decimates AIS tracks for the track explorer page.
+    Vessels are given by mmsi, or by call sign if an MMSI table is given.
+    """
+
+    def __init__(self, ais_path: str, mmsi_path: str | None = None):
+        self.ais_path = ais_path
+        self.mmsi_path = mmsi_path
+        self._mmsi_data: DataFrame | None = None
+        self._tracks = TrackCache()
+
+    def find_mmsi(self, vessel: str, start: date, end: date) -> list[int]:
+        """
+        Returns the mmsi of a vessel given by mmsi or call sign. For call
+        signs only the mmsi valid at some time between start and end are
+        returned.
+        """
+        vessel = vessel.strip()
+        if vessel.isdigit():
+            return [int(vessel)]
+        if self.mmsi_path is None:
+            return []
+        if self._mmsi_data is None:
+            self._mmsi_data = read_mmsi_mapping(self.mmsi_path)
+        mapping = self._mmsi_data
+        # valid_to is not included, and the end date is included
+        valid = ~(mapping[VALID_FROM] >= pd.Timestamp(end) + pd.Timedelta(days=1))
+        valid &= ~(mapping[VALID_TO] <= pd.Timestamp(start))
+        is_vessel = (mapping["kallesignal"] == vessel.upper()) & valid
+        return sorted(int(m) for m in mapping.loc[is_vessel, "mmsi"].unique())
+
+    def figure(
+        self,
+        vessel: str,
+        start: date,
+        end: date,
+        x_range: list[float] | None = None,
+        y_range: list[float] | None = None,
+    ) -> Figure:
+        """
+        Creates the figure of a vessel track, decimated for the view
+        given by x_range and y_range.
+        """
+        mmsi = self.find_mmsi(vessel, start, end)
+        if not mmsi:
+            return go.Figure()
+        with span("read"):
+            track = self._tracks.read(self.ais_path, tuple(mmsi), start, end)
+        with span("aggregate"):
+            track = decimate_track(track, x_range, y_range)
+        with span("plot"):
+            fig = fig_track(track)
+        # Keep the zoom while the same track is shown
+        fig.update_layout(uirevision=f"{vessel}_{start}_{end}")
+        return fig
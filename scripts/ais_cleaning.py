@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+from geo import haversine
+from pandas import DataFrame
+
+# Pings of a vessel closer in time than this are near duplicates
+DUPLICATE_INTERVAL = pd.Timedelta(seconds=1)
+
+# Speed in knots above which a position jump is not physically possible
+MAX_SPEED_KNOTS = 50.0
+
+KNOTS_PER_KM_H = 1 / 1.852
+
+# Rules in the order they are applied
+RULES = ["invalid_position", "exact_duplicate", "near_duplicate", "speed_outlier"]
+
+
+def clean_ais(
+    ais_data: DataFrame,
+    max_speed: float = MAX_SPEED_KNOTS,
+    duplicate_interval: pd.Timedelta = DUPLICATE_INTERVAL,
+) -> tuple[DataFrame, dict]:
+    """
+    Cleans raw AIS data before it is marked. The data is sorted by mmsi and
+    time, and rows are dropped by these rules, in order:
+
+    - invalid_position: latitude or longitude missing or out of range,
+      like the 91 and 181 AIS uses for unavailable positions
+    - exact_duplicate: rows equal to an earlier row
+    - near_duplicate: pings less than duplicate_interval after the
+      previous ping of the same vessel
+    - speed_outlier: pings that imply more than max_speed knots both from
+      the previous and to the next ping of the same vessel. The first and
+      last ping of a vessel only have one side, and are dropped if it is
+      fast, unless the jump is explained by their neighbour being an
+      outlier itself
+
+    Returns the cleaned data with a new index, and the number
+    of rows dropped by each rule.
+    """
+    dropped = {}
+
+    lat = ais_data["lat"]
+    lon = ais_data["lon"]
+    valid = lat.between(-90, 90) & lon.between(-180, 180)
+    dropped["invalid_position"] = int((~valid).sum())
+    df = ais_data[valid]
+
+    exact = df.duplicated()
+    dropped["exact_duplicate"] = int(exact.sum())
+    df = df[~exact].sort_values(["mmsi", "date_time_utc"], kind="stable")
+
+    mmsi = df["mmsi"].to_numpy()
+    times = df["date_time_utc"].to_numpy()
+    near = np.zeros(len(df), dtype=bool)
+    near[1:] = (mmsi[1:] == mmsi[:-1]) & (
+        times[1:] - times[:-1] < duplicate_interval.to_timedelta64()
+    )
+    dropped["near_duplicate"] = int(near.sum())
+    df = df[~near]
+
+    # Implied speed from each ping to the next ping of the same vessel
+    mmsi = df["mmsi"].to_numpy()
+    times = df["date_time_utc"].to_numpy()
+    lat = df["lat"].to_numpy()
+    lon = df["lon"].to_numpy()
+    if len(df) > 1:
+        hours = (times[1:] - times[:-1]) / np.timedelta64(1, "h")
+        km = haversine(lat[:-1], lon[:-1], lat[1:], lon[1:])
+        same = mmsi[1:] == mmsi[:-1]
+        # Pings of different vessels can have the same time
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fast = same & (km / hours * KNOTS_PER_KM_H > max_speed)
+        # A jump is fast on both sides, the ends of a series only on one
+        fast_in = np.concatenate([[False], fast])
+        fast_out = np.concatenate([fast, [False]])
+        first = np.concatenate([[True], ~same])
+        last = np.concatenate([~same, [True]])
+        jump = fast_in & fast_out
+        next_jump = np.concatenate([jump[1:], [False]])
+        previous_jump = np.concatenate([[False], jump[:-1]])
+        outlier = (
+            jump | (first & fast_out & ~next_jump) | (last & fast_in & ~previous_jump)
+        )
+    else:
+        outlier = np.zeros(len(df), dtype=bool)
+    dropped["speed_outlier"] = int(outlier.sum())
+    df = df[~outlier]
+
+    return df.reset_index(drop=True), dropped
@@ -0,0 +1,63 @@
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+from pandas import DataFrame
+
+# Arrow strings are kept as string[pyarrow], which wraps the memory mapped
+# data, instead of being copied into Python strings
+_TYPES = {
+    pa.string(): pd.StringDtype("pyarrow"),
+    pa.large_string(): pd.StringDtype("pyarrow"),
+}
+
+
+def arrow_path(csv_path: str) -> str:
+    """
+    Returns the path of the Arrow file stored next to a csv file.
+    """
+    return f"{os.path.splitext(csv_path)[0]}.arrow"
+
+
+def write_arrow(df: DataFrame, path: str) -> None:
+    """
+    Writes a dataframe as an uncompressed Arrow IPC (Feather v2) file,
+    so it can be memory mapped. The file is written to a temporary file
+    and moved in place, so readers never see a partially written file.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    feather.write_feather(
+        df.reset_index(drop=True), tmp_path, compression="uncompressed"
+    )
+    os.replace(tmp_path, path)
+
+
+def read_arrow(path: str, columns: list[str] | None = None) -> DataFrame:
+    """
+    Memory maps an Arrow file written by write_arrow. Columns without
+    missing values point directly into the mapped file, so loading is
+    near instant and processes reading the same file share its pages
+    through the OS page cache.
+    """
+    with pa.memory_map(path) as source:
+        table = pa.ipc.open_file(source).read_all()
+    if columns is not None:
+        table = table.select(columns)
+    return table.to_pandas(split_blocks=True, types_mapper=_TYPES.get)
+
+
+def read_table(
+    csv_path: str, columns: list[str] | None = None, dtype: dict | None = None
+) -> DataFrame:
+    """
+    Reads a table stored as csv. The Arrow file next to the csv file is
+    memory mapped instead, if it exists and is at least as new as the csv.
+    """
+    path = arrow_path(csv_path)
+    if os.path.exists(path) and (
+        not os.path.exists(csv_path)
+        or os.path.getmtime(path) >= os.path.getmtime(csv_path)
+    ):
+        return read_arrow(path, columns)
+    return pd.read_csv(csv_path, usecols=columns, dtype=dtype)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from pandas import DataFrame
+from telemetry import Telemetry, add_telemetry_arguments
+
+KEYS = ["year", "month", "mmsi", "cell"]
+
+# Partial results are merged after this many files, to bound memory
+MERGE_EVERY = 64
+
+
+def list_marked_ais(path: str) -> list[str]:
+    """
+    Lists the marked AIS parquet files in a directory and its
+    subdirectories, as written by process_ais.py.
+    """
+    files = []
+    for folder_name, _, file_names in os.walk(path):
+        for filename in file_names:
+            if filename.startswith("AIS") and filename.endswith(".parquet"):
+                files.append(os.path.join(folder_name, filename))
+    return sorted(files)
+
+
+def cell_id(lat: np.ndarray, lon: np.ndarray, cell_size: float) -> np.ndarray:
+    """
+    Returns the id of the grid cell of each position, on a global grid of
+    cell_size by cell_size degrees. Cells are numbered row by row from the
+    south west corner.
+    """
+    n_rows = int(round(180 / cell_size))
+    n_cols = int(round(360 / cell_size))
+    row = np.clip(np.floor((lat + 90) / cell_size), 0, n_rows - 1).astype(np.int64)
+    col = np.floor((lon + 180) / cell_size).astype(np.int64) % n_cols
+    return row * n_cols + col
+
+
+def cell_center(cell: np.ndarray, cell_size: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the latitude and longitude of the center of grid cells.
+    """
+    n_cols = int(round(360 / cell_size))
+    lat = (cell // n_cols + 0.5) * cell_size - 90
+    lon = (cell % n_cols + 0.5) * cell_size - 180
+    return lat, lon
+
+
+def aggregate_file(
+    path: str, cell_size: float, max_gap: pd.Timedelta
+) -> tuple[DataFrame, int]:
+    """
+    Aggregates the fishing effort of a marked AIS file.
+
+    Each fishing ping is given the time until the next ping of the same
+    vessel, capped at max_gap, and the times are summed per grid cell,
+    month and vessel. The last ping of a vessel in a file has no next
+    ping and is only counted as a ping.
+
+    Returns the partial result, and the number of rows read.
+    """
+    df = pq.read_table(
+        path, columns=["mmsi", "date_time_utc", "lon", "lat", "fishing"]
+    ).to_pandas()
+    rows = len(df)
+    df = df.dropna(subset=["lon", "lat"])
+    df = df.sort_values(["mmsi", "date_time_utc"], kind="stable")
+
+    times = df["date_time_utc"].to_numpy().astype(np.int64)
+    mmsi = df["mmsi"].to_numpy()
+    delta = np.zeros(len(df), dtype=np.int64)
+    if len(df) > 1:
+        delta[:-1] = np.diff(times)
+        delta[:-1][mmsi[1:] != mmsi[:-1]] = 0
+    delta = np.minimum(delta, max_gap.value)
+
+    fishing = df["fishing"].to_numpy(dtype=bool)
+    effort = DataFrame(
+        {
+            "year": df["date_time_utc"].dt.year.to_numpy()[fishing],
+            "month": df["date_time_utc"].dt.month.to_numpy()[fishing],
+            "mmsi": mmsi[fishing],
+            "cell": cell_id(
+                df["lat"].to_numpy()[fishing], df["lon"].to_numpy()[fishing], cell_size
+            ),
+            "hours": delta[fishing] / 3.6e12,
+            "pings": np.ones(fishing.sum(), dtype=np.int64),
+        }
+    )
+    return merge_effort([effort]), rows
+
+
+def merge_effort(partials: list[DataFrame]) -> DataFrame:
+    """
+    Merges partial results by summing hours and pings of the same
+    grid cell, month and vessel.
+    """
+    return (
+        pd.concat(partials, ignore_index=True)
+        .groupby(KEYS, as_index=False)[["hours", "pings"]]
+        .sum()
+    )
+
+
+def fishing_effort(
+    path: str,
+    cell_size: float = 0.05,
+    max_gap: pd.Timedelta = pd.Timedelta(minutes=60),
+    jobs: int | None = None,
+    telemetry: Telemetry | None = None,
+) -> DataFrame:
+    """
+    Aggregates hours fished per grid cell, month and vessel over all
+    marked AIS files in a directory. Files are aggregated in parallel,
+    and only the aggregated results are kept in memory.
+
+    Parameters:
+    -----------
+    path: directory with marked AIS data
+    cell_size: size of grid cells in degrees
+    max_gap: longest time between two pings counted as fishing
+    jobs: number of processes, defaults to the number of CPUs
+    telemetry: optional telemetry to measure aggregation and merging
+    """
+    if telemetry is None:
+        telemetry = Telemetry("fishing_effort")
+    files = list_marked_ais(path)
+
+    pending = []
+    with telemetry.stage("aggregate") as stage:
+        stage.rows_in = 0
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = executor.map(
+                partial(aggregate_file, cell_size=cell_size, max_gap=max_gap),
+                files,
+                chunksize=4,
+            )
+            for effort, rows in results:
+                stage.rows_in += rows
+                pending.append(effort)
+                # The merged result is kept as the first partial, so only
+                # one result per cell is kept between merges
+                if len(pending) >= MERGE_EVERY:
+                    pending = [merge_effort(pending)]
+        stage.metrics["files"] = len(files)
+
+    with telemetry.stage("merge") as stage:
+        effort = (
+            merge_effort(pending)
+            if files
+            else DataFrame(columns=KEYS + ["hours", "pings"])
+        )
+        lat, lon = cell_center(effort["cell"].to_numpy(dtype=np.int64), cell_size)
+        effort["lat"] = lat
+        effort["lon"] = lon
+        effort = effort.sort_values(KEYS, ignore_index=True)
+        stage.rows_out = len(effort)
+    return effort
+
+
+def main(args) -> None:
+    telemetry = Telemetry.from_args("fishing_effort", args)
+    effort = fishing_effort(
+        args.path,
+        cell_size=args.cell_size,
+        max_gap=pd.Timedelta(minutes=args.max_gap),
+        jobs=args.jobs,
+        telemetry=telemetry,
+    )
+    with telemetry.stage("write", rows_in=len(effort)):
+        effort.to_parquet(args.target, index=False)
+
+    print(f"Stored {len(effort)} cells, {effort['hours'].sum():.0f} hours fished")
+    telemetry.print_summary()
+    telemetry.write_report()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Aggregates hours fished per grid cell, month and vessel\
+        from marked AIS data."
+    )
+    parser.add_argument("path", help="Directory containing marked AIS data")
+    parser.add_argument("target", help="Path to parquet file where results are stored")
+    parser.add_argument(
+        "--cell_size", type=float, default=0.05, help="Size of grid cells in degrees"
+    )
+    parser.add_argument(
+        "--max_gap",
+        type=float,
+        default=60,
+        help="Longest time in minutes between two pings counted as fishing",
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=None, help="Number of processes"
+    )
+    add_telemetry_arguments(parser)
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,90 @@
+import pandas as pd
+from pandas import DataFrame
+
+# Optional columns of the MMSI table with the period a mapping is valid,
+# from valid_from up to but not including valid_to. Missing dates mean
+# the mapping is valid from the start or to the end.
+VALID_FROM = "valid_from"
+VALID_TO = "valid_to"
+
+
+def read_mmsi_mapping(path: str) -> DataFrame:
+    """
+    Reads a table mapping call signs (kallesignal) to mmsi, from an xlsx or
+    csv file. Returns the columns kallesignal, mmsi, valid_from and valid_to,
+    where valid_from and valid_to are NaT if the table has no validity
+    periods.
+    """
+    if path.endswith(".csv"):
+        mapping = pd.read_csv(path)
+    else:
+        mapping = pd.read_excel(path)
+    for column in [VALID_FROM, VALID_TO]:
+        if column not in mapping.columns:
+            mapping[column] = pd.NaT
+        mapping[column] = pd.to_datetime(mapping[column])
+    mapping = mapping.dropna(subset=["kallesignal", "mmsi"])
+    return mapping[["kallesignal", "mmsi", VALID_FROM, VALID_TO]].reset_index(drop=True)
+
+
+def ambiguous_mappings(mapping: DataFrame) -> DataFrame:
+    """
+    Returns the mappings of call signs that map to more than one mmsi at
+    the same time, that is, with overlapping validity periods and different
+    mmsi. Repeated mappings to the same mmsi are not ambiguous.
+    """
+    df = mapping.assign(
+        start=mapping[VALID_FROM].fillna(pd.Timestamp.min),
+        stop=mapping[VALID_TO].fillna(pd.Timestamp.max),
+    )
+    # Every pair of mappings of the same call sign, call signs have few
+    pairs = df.merge(df, on="kallesignal", suffixes=("", "_other"))
+    overlapping = (
+        (pairs["mmsi"] != pairs["mmsi_other"])
+        & (pairs["start"] < pairs["stop_other"])
+        & (pairs["start_other"] < pairs["stop"])
+    )
+    call_signs = pairs.loc[overlapping, "kallesignal"].unique()
+    return mapping[mapping["kallesignal"].isin(call_signs)].sort_values(
+        ["kallesignal", VALID_FROM], na_position="first"
+    )
+
+
+def assign_mmsi(
+    df: DataFrame,
+    time_column: str,
+    mapping: DataFrame,
+    call_sign_column: str = "Radiokallesignal (ERS)",
+) -> DataFrame:
+    """
+    Adds the mmsi a vessel had at the time of each row, with an as-of join
+    on the validity periods of the mapping. Each row gets at most one mmsi,
+    and rows without a valid mapping are dropped. When periods overlap,
+    the mapping that started last is used.
+
+    Parameters:
+    -----------
+    df: dataframe with call signs and times
+    time_column: column with the times the mmsi must be valid at
+    mapping: mapping from read_mmsi_mapping
+    call_sign_column: column with call signs
+    """
+    mapping = mapping.assign(
+        kallesignal=mapping["kallesignal"].astype(df[call_sign_column].dtype),
+        start=mapping[VALID_FROM].fillna(pd.Timestamp.min).astype("datetime64[ns]"),
+    ).sort_values(["start", "mmsi"])
+
+    rows = df.dropna(subset=[time_column, call_sign_column]).sort_values(time_column)
+    merged = pd.merge_asof(
+        rows,
+        mapping[["kallesignal", "mmsi", "start", VALID_TO]],
+        left_on=time_column,
+        right_on="start",
+        left_by=call_sign_column,
+        right_by="kallesignal",
+        direction="backward",
+    )
+    valid = merged["mmsi"].notna() & ~(merged[time_column] >= merged[VALID_TO])
+    merged = merged[valid.to_numpy()].drop(columns=["kallesignal", "start", VALID_TO])
+    merged["mmsi"] = merged["mmsi"].astype("int64")
+    return merged.sort_values(time_column, ignore_index=True)
@@ -0,0 +1,530 @@
+#!/usr/bin/env python3
+import argparse
+import ast
+import glob
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import ais_cleaning
+import extract_ers_data
+import fishing_effort
+import process_ais
+import process_dca
+import process_fishing_trips
+import process_tra
+import trip_summary
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_FILE = ".pipeline_cache.json"
+
+
+class Stage:
+    """
+    A stage of the pipeline.
+
+    Args:
+        name (str) : Name of the stage.
+        function (func) : Module level function running the stage,
+            called with params as keyword arguments.
+        inputs (list) : Files and directories read by the stage.
+        outputs (list) : Files and directories written by the stage.
+        deps (list) : Names of stages that must run before this stage.
+        params (dict) : Parameters of the stage, must be JSON serializable.
+        options (dict) : Additional arguments that do not change the
+            results of the stage, and are not part of the cache key.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        function,
+        inputs: list[str],
+        outputs: list[str],
+        deps: list[str] | None = None,
+        params: dict | None = None,
+        options: dict | None = None,
+    ):
+        self.name = name
+        self.function = function
+        self.inputs = inputs
+        self.outputs = outputs
+        self.deps = deps or []
+        self.params = params or {}
+        self.options = options or {}
+
+
+def script_sources(path: str) -> list[str]:
+    """
+    Returns the path of a script and of the modules in the script directory
+    that it imports, directly or through other modules, so a change to any
+    of them changes the cache key of the stage running the script.
+    """
+    sources = []
+    pending = [path]
+    while pending:
+        source = pending.pop()
+        if source in sources:
+            continue
+        sources.append(source)
+        with open(source) as f:
+            tree = ast.parse(f.read(), filename=source)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                module = os.path.join(SCRIPT_DIR, f"{name.split('.')[0]}.py")
+                if os.path.exists(module):
+                    pending.append(module)
+    return sorted(sources)
+
+
+class FileHasher:
+    """
+    Hashes the content of files and directories. Hashes are remembered
+    by path, size and modification time, so unchanged files are only
+    read once across runs.
+    """
+
+    def __init__(self, known: dict | None = None):
+        self.known = known or {}
+
+    def _hash_file(self, path: str) -> str:
+        stat = os.stat(path)
+        known = self.known.get(path)
+        if known is not None and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return known[2]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(2**20), b""):
+                digest.update(block)
+        self.known[path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def hash(self, path: str) -> str | None:
+        """
+        Returns the hash of a file, or of all files in a directory.
+        Returns None if the path does not exist.
+        """
+        if not os.path.exists(path):
+            return None
+        if not os.path.isdir(path):
+            return self._hash_file(path)
+
+        digest = hashlib.sha256()
+        for folder_name, _, file_names in sorted(os.walk(path)):
+            for filename in sorted(file_names):
+                f_path = os.path.join(folder_name, filename)
+                digest.update(os.path.relpath(f_path, path).encode())
+                digest.update(self._hash_file(f_path).encode())
+        return digest.hexdigest()
+
+
+def stage_key(stage: Stage, hasher: FileHasher) -> str:
+    """
+    Returns the cache key of a stage, a hash of its name,
+    parameters and the content of its inputs.
+    """
+    digest = hashlib.sha256()
+    digest.update(stage.name.encode())
+    digest.update(json.dumps(stage.params, sort_keys=True).encode())
+    for path in stage.inputs:
+        digest.update(path.encode())
+        digest.update(str(hasher.hash(path)).encode())
+    return digest.hexdigest()
+
+
+def is_cached(stage: Stage, key: str, cache: dict, hasher: FileHasher) -> bool:
+    """
+    Checks if a stage has run with the same key,
+    and that its outputs are unchanged since.
+    """
+    entry = cache.get(stage.name)
+    if entry is None or entry["key"] != key:
+        return False
+    return all(
+        hasher.hash(path) == entry["outputs"].get(path) for path in stage.outputs
+    )
+
+
+def run_pipeline(
+    stages: list[Stage], cache_path: str, jobs: int = 2, force: list[str] | None = None
+) -> None:
+    """
+    Runs stages in order of their dependencies. Stages whose dependencies
+    are done run in parallel, and stages with unchanged inputs and
+    parameters are skipped.
+
+    Parameters:
+    -----------
+    stages: stages of the pipeline
+    cache_path: JSON file where stage keys and output hashes are stored
+    jobs: number of stages run in parallel
+    force: names of stages that are run even if they are cached
+    """
+    force = force or []
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path) as f:
+            cache = json.load(f)
+    hasher = FileHasher(cache.pop("_files", {}))
+
+    def save_cache():
+        with open(cache_path, "w") as f:
+            json.dump({**cache, "_files": hasher.known}, f, indent=2)
+
+    by_name = {stage.name: stage for stage in stages}
+    for stage in stages:
+        for dep in stage.deps:
+            if dep not in by_name:
+                raise ValueError(f"Stage {stage.name} depends on unknown stage {dep}")
+
+    done = set()
+    running = {}
+    keys = {}
+    started = {}
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        while len(done) < len(stages):
+            ready = [
+                stage
+                for stage in stages
+                if stage.name not in done
+                and stage.name not in running.values()
+                and all(dep in done for dep in stage.deps)
+            ]
+            for stage in ready:
+                key = stage_key(stage, hasher)
+                if stage.name not in force and is_cached(stage, key, cache, hasher):
+                    print(f"[{stage.name}] unchanged, skipped")
+                    done.add(stage.name)
+                    continue
+                print(f"[{stage.name}] running")
+                future = executor.submit(
+                    stage.function, **stage.params, **stage.options
+                )
+                running[future] = stage.name
+                keys[stage.name] = key
+                started[stage.name] = time.perf_counter()
+
+            if not running:
+                if len(done) < len(stages) and not ready:
+                    raise ValueError("Stages have circular dependencies")
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                future.result()
+                stage = by_name[name]
+                cache[name] = {
+                    "key": keys[name],
+                    "outputs": {path: hasher.hash(path) for path in stage.outputs},
+                }
+                save_cache()
+                done.add(name)
+                print(f"[{name}] done in {time.perf_counter() - started[name]:.1f} s")
+    save_cache()
+
+
+def _run_extract(data_path: str, target_path: str) -> None:
+    os.makedirs(target_path, exist_ok=True)
+    extract_ers_data.extract_ers(data_path, target_path)
+
+
+def _telemetry_args(telemetry_dir: str | None, name: str) -> dict:
+    report = None
+    if telemetry_dir is not None:
+        report = os.path.join(telemetry_dir, f"{name}.json")
+    return {"telemetry": report, "profile_stage": None, "profiler": "cprofile"}
+
+
+def _run_dca(path: str, target_dir: str, telemetry_dir: str | None) -> None:
+    os.makedirs(target_dir, exist_ok=True)
+    process_dca.main(
+        argparse.Namespace(
+            path=path,
+            target_dir=target_dir,
+            is_dir=True,
+            combine=True,
+            **_telemetry_args(telemetry_dir, "dca"),
+        )
+    )
+
+
+def _run_trips(
+    dep_path: str, por_path: str, target_csv: str, telemetry_dir: str | None
+) -> None:
+    process_fishing_trips.main(
+        argparse.Namespace(
+            dep_path=dep_path,
+            por_path=por_path,
+            target_csv=target_csv,
+            **_telemetry_args(telemetry_dir, "trips"),
+        )
+    )
+
+
+def _run_ais(
+    path: str,
+    target_dir: str,
+    dca_path: str,
+    f_trips_path: str,
+    mmsi_path: str,
+    telemetry_dir: str | None,
+) -> None:
+    os.makedirs(target_dir, exist_ok=True)
+    process_ais.main(
+        argparse.Namespace(
+            path=path,
+            target_dir=target_dir,
+            dca_path=dca_path,
+            f_trips_path=f_trips_path,
+            mmsi_path=mmsi_path,
+            is_dir=True,
+            zip=False,
+            prefetch=2,
+            clean=False,
+            max_speed=ais_cleaning.MAX_SPEED_KNOTS,
+            **_telemetry_args(telemetry_dir, "ais"),
+        )
+    )
+
+
+def _run_effort(path: str, target: str, telemetry_dir: str | None) -> None:
+    fishing_effort.main(
+        argparse.Namespace(
+            path=path,
+            target=target,
+            cell_size=0.05,
+            max_gap=60,
+            jobs=None,
+            **_telemetry_args(telemetry_dir, "effort"),
+        )
+    )
+
+
+def _run_trip_summary(
+    path: str,
+    f_trips_path: str,
+    mmsi_path: str,
+    target_csv: str,
+    telemetry_dir: str | None,
+) -> None:
+    trip_summary.main(
+        argparse.Namespace(
+            path=path,
+            f_trips_path=f_trips_path,
+            mmsi_path=mmsi_path,
+            target_csv=target_csv,
+            jobs=None,
+            **_telemetry_args(telemetry_dir, "trip_summary"),
+        )
+    )
+
+
+def _run_tra(
+    tra_path: str, f_trips_path: str, target_csv: str, telemetry_dir: str | None
+) -> None:
+    process_tra.main(
+        argparse.Namespace(
+            tra_path=tra_path,
+            f_trips_path=f_trips_path,
+            target_csv=target_csv,
+            **_telemetry_args(telemetry_dir, "tra"),
+        )
+    )
+
+
+def build_stages(
+    ers_path: str,
+    ais_path: str,
+    mmsi_path: str,
+    work_dir: str,
+    telemetry_dir: str | None = None,
+) -> list[Stage]:
+    """
+    Creates the stages of the full pipeline, from raw ERS and AIS data
+    to marked AIS data, the fishing effort and trip summaries aggregated
+    from it, and the transfers of each trip. The source of each script is
+    an input of its stage, together with the modules it imports, so
+    changes to them rerun the stage.
+    """
+    ers_dir = os.path.join(work_dir, "ers")
+    processed_dir = os.path.join(work_dir, "processed")
+    dca_dir = os.path.join(processed_dir, "dca")
+    trips_csv = os.path.join(processed_dir, "fishing_trips.csv")
+    trips_arrow = os.path.join(processed_dir, "fishing_trips.arrow")
+    ais_dir = os.path.join(processed_dir, "ais")
+    effort_path = os.path.join(processed_dir, "fishing_effort.parquet")
+    trips_ais_csv = os.path.join(processed_dir, "fishing_trips_ais.csv")
+    trips_tra_csv = os.path.join(processed_dir, "fishing_trips_tra.csv")
+
+    def script(name):
+        return script_sources(os.path.join(SCRIPT_DIR, name))
+
+    return [
+        Stage(
+            "extract",
+            _run_extract,
+            inputs=sorted(glob.glob(os.path.join(ers_path, "*.zip")))
+            + script("extract_ers_data.py"),
+            outputs=[ers_dir],
+            params={"data_path": ers_path, "target_path": ers_dir},
+        ),
+        Stage(
+            "dca",
+            _run_dca,
+            inputs=[os.path.join(ers_dir, "dca"), *script("process_dca.py")],
+            outputs=[dca_dir],
+            deps=["extract"],
+            params={
+                "path": os.path.join(ers_dir, "dca"),
+                "target_dir": dca_dir,
+            },
+            options={"telemetry_dir": telemetry_dir},
+        ),
+        Stage(
+            "trips",
+            _run_trips,
+            inputs=[
+                os.path.join(ers_dir, "dep"),
+                os.path.join(ers_dir, "por"),
+                *script("process_fishing_trips.py"),
+            ],
+            outputs=[trips_csv, trips_arrow],
+            deps=["extract"],
+            params={
+                "dep_path": os.path.join(ers_dir, "dep"),
+                "por_path": os.path.join(ers_dir, "por"),
+                "target_csv": trips_csv,
+            },
+            options={"telemetry_dir": telemetry_dir},
+        ),
+        Stage(
+            "ais",
+            _run_ais,
+            inputs=sorted(glob.glob(os.path.join(ais_path, "*.zip")))
+            + [
+                os.path.join(dca_dir, "combined.csv"),
+                os.path.join(dca_dir, "combined.arrow"),
+                trips_csv,
+                trips_arrow,
+                mmsi_path,
+                *script("process_ais.py"),
+            ],
+            outputs=[ais_dir],
+            deps=["dca", "trips"],
+            params={
+                "path": ais_path,
+                "target_dir": ais_dir,
+                "dca_path": os.path.join(dca_dir, "combined.csv"),
+                "f_trips_path": trips_csv,
+                "mmsi_path": mmsi_path,
+            },
+            options={"telemetry_dir": telemetry_dir},
+        ),
+        Stage(
+            "effort",
+            _run_effort,
+            inputs=[ais_dir, *script("fishing_effort.py")],
+            outputs=[effort_path],
+            deps=["ais"],
+            params={"path": ais_dir, "target": effort_path},
+            options={"telemetry_dir": telemetry_dir},
+        ),
+        Stage(
+            "trip_summary",
+            _run_trip_summary,
+            inputs=[
+                ais_dir,
+                trips_csv,
+                trips_arrow,
+                mmsi_path,
+                *script("trip_summary.py"),
+            ],
+            outputs=[
+                trips_ais_csv,
+                os.path.join(processed_dir, "fishing_trips_ais.arrow"),
+            ],
+            deps=["ais"],
+            params={
+                "path": ais_dir,
+                "f_trips_path": trips_csv,
+                "mmsi_path": mmsi_path,
+                "target_csv": trips_ais_csv,
+            },
+            options={"telemetry_dir": telemetry_dir},
+        ),
+        Stage(
+            "tra",
+            _run_tra,
+            inputs=[
+                os.path.join(ers_dir, "tra"),
+                trips_csv,
+                trips_arrow,
+                *script("process_tra.py"),
+            ],
+            outputs=[
+                trips_tra_csv,
+                os.path.join(processed_dir, "fishing_trips_tra.arrow"),
+            ],
+            deps=["extract", "trips"],
+            params={
+                "tra_path": os.path.join(ers_dir, "tra"),
+                "f_trips_path": trips_csv,
+                "target_csv": trips_tra_csv,
+            },
+            options={"telemetry_dir": telemetry_dir},
+        ),
+    ]
+
+
+def main(args) -> None:
+    os.makedirs(args.work_dir, exist_ok=True)
+    telemetry_dir = None
+    if args.telemetry:
+        telemetry_dir = os.path.join(args.work_dir, "telemetry")
+        os.makedirs(telemetry_dir, exist_ok=True)
+
+    stages = build_stages(
+        args.ers_path, args.ais_path, args.mmsi_path, args.work_dir, telemetry_dir
+    )
+    run_pipeline(
+        stages,
+        os.path.join(args.work_dir, CACHE_FILE),
+        jobs=args.jobs,
+        force=args.force,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Runs the whole pipeline from raw ERS and AIS data to marked\
+        AIS data. Independent stages run in parallel, and stages with unchanged\
+        inputs are skipped."
+    )
+    parser.add_argument("ers_path", help="Directory containing raw ERS data.")
+    parser.add_argument("ais_path", help="Directory containing zipped AIS data.")
+    parser.add_argument("mmsi_path", help="Path to MMSI data in xlsx format")
+    parser.add_argument("work_dir", help="Directory where all results are stored")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=2, help="Number of stages run in parallel"
+    )
+    parser.add_argument(
+        "--force", nargs="*", default=[], help="Names of stages to rerun"
+    )
+    parser.add_argument(
+        "--telemetry",
+        action="store_true",
+        help="Store a telemetry report of each stage in work_dir/telemetry",
+    )
+    args = parser.parse_args()
+
+    main(args)
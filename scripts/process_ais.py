@@ -1,34 +1,50 @@
 #!/usr/bin/env python3
 import argparse
 import os
+import queue
+import threading
+import time
 from datetime import datetime
 from zipfile import ZipFile
 
 import numpy as np
 import pandas as pd
+from ais_cleaning import MAX_SPEED_KNOTS, RULES, clean_ais
+from arrow_io import read_table
+from mmsi_mapping import ambiguous_mappings, assign_mmsi, read_mmsi_mapping
 from pandas import DataFrame
+from schema import DCA, FISHING_TRIPS
+from telemetry import Telemetry, add_telemetry_arguments
 
 
 def get_dca_with_mmsi(dca_data_path: str, mmsi_data_path: str) -> DataFrame:
     """
     Merges dca and mmsi data.
     Returns a dataframe with DCA start and stop times
-    as well as the mmsi and duration.
+    as well as the mmsi and duration. Each haul gets the
+    mmsi that was valid at its start time.
 
     Parameters:
     -----------
-    dca_data_path: path to dca data
+    dca_data_path: path to dca data, the Arrow file
+        next to it is memory mapped if it is up to date
     mmsi_data_path: path to mmsi data
     """
-    dca_data = pd.read_csv(dca_data_path)
-    mmsi_data = pd.read_excel(mmsi_data_path)
-    mmsi_data = mmsi_data[["mmsi", "kallesignal"]]
-
-    merged = dca_data.merge(
-        mmsi_data, left_on="Radiokallesignal (ERS)", right_on="kallesignal"
-    ).drop(columns=["kallesignal"])
-    merged["Starttidspunkt"] = pd.to_datetime(merged["Starttidspunkt"])
-    merged["Stopptidspunkt"] = pd.to_datetime(merged["Stopptidspunkt"])
+    dca_data = read_table(
+        dca_data_path,
+        columns=[
+            "Starttidspunkt",
+            "Stopptidspunkt",
+            "Radiokallesignal (ERS)",
+            "Varighet",
+        ],
+        dtype=DCA,
+    )
+    dca_data["Starttidspunkt"] = pd.to_datetime(dca_data["Starttidspunkt"])
+    dca_data["Stopptidspunkt"] = pd.to_datetime(dca_data["Stopptidspunkt"])
+
+    mmsi_data = read_mmsi_mapping(mmsi_data_path)
+    merged = assign_mmsi(dca_data, "Starttidspunkt", mmsi_data)
     return merged[["Starttidspunkt", "Stopptidspunkt", "mmsi", "Varighet"]]
 
 
@@ -38,22 +54,30 @@ def get_fish_trips_with_mmsi(
     """
     Merges fishing trip data and mmsi data.
     Returns a dataframe with DCA start and stop times
-    as well as the mmsi and trip id.
+    as well as the mmsi and trip id. Each trip gets the
+    mmsi that was valid at its departure time.
 
     Parameters:
     -----------
-    fish_trip_data_path: path to fishing trips data
+    fish_trip_data_path: path to fishing trips data, the Arrow file
+        next to it is memory mapped if it is up to date
     mmsi_data_path: path to mmsi data
     """
-    ft = pd.read_csv(fish_trip_data_path)
-    mmsi_data = pd.read_excel(mmsi_data_path)
-    mmsi_data = mmsi_data[["mmsi", "kallesignal"]]
-
-    merged = ft.merge(mmsi_data, left_on="ERS", right_on="kallesignal").drop(
-        columns=["kallesignal"]
+    ft = read_table(
+        fish_trip_data_path,
+        columns=[
+            "Avgangstidspunkt",
+            "Ankomsttidspunkt",
+            "Radiokallesignal (ERS)",
+            "trip_id",
+        ],
+        dtype=FISHING_TRIPS,
     )
-    merged["Avgangstidspunkt"] = pd.to_datetime(merged["Avgangstidspunkt"])
-    merged["Ankomsttidspunkt"] = pd.to_datetime(merged["Ankomsttidspunkt"])
+    ft["Avgangstidspunkt"] = pd.to_datetime(ft["Avgangstidspunkt"])
+    ft["Ankomsttidspunkt"] = pd.to_datetime(ft["Ankomsttidspunkt"])
+
+    mmsi_data = read_mmsi_mapping(mmsi_data_path)
+    merged = assign_mmsi(ft, "Avgangstidspunkt", mmsi_data)
     return merged[["Avgangstidspunkt", "Ankomsttidspunkt", "mmsi", "trip_id"]]
 
 
@@ -86,7 +110,8 @@ def _apply_marks(chunk, dca_slice, fishing_trips) -> DataFrame:
     Helper function to mark AIS row with DCA duration and fishing state,
     and fishing trip id.
     """
-    trip_ids = fishing_trips["trip_id"].values
+    # Arrow backed strings have no max, ids are compared as Python strings
+    trip_ids = fishing_trips["trip_id"].to_numpy(dtype=object)
     duration = dca_slice["Varighet"].values
 
     is_in_interval_trip = _calculate_in_interval(
@@ -111,8 +136,60 @@ def _apply_marks(chunk, dca_slice, fishing_trips) -> DataFrame:
     return chunk
 
 
+# Columns of the raw AIS data
+AIS_DTYPES = {
+    "mmsi": int,
+    "date_time_utc": object,
+    "lon": float,
+    "lat": float,
+    "sog": float,
+    "cog": float,
+    "true_heading": int,
+    "nav_status": int,
+    "message_nr": int,
+}
+
+# Marks a queue of the AIS folder pipeline as finished
+_DONE = object()
+
+
+def read_ais(file_path: str) -> DataFrame:
+    """
+    Reads a single compressed zip file with AIS data.
+    """
+    ais_data = pd.read_csv(file_path, sep=";", dtype=AIS_DTYPES, compression="zip")
+    ais_data["date_time_utc"] = pd.to_datetime(ais_data["date_time_utc"])
+    return ais_data
+
+
+def mark_ais(
+    ais_data: DataFrame, file_path: str, dca_data: DataFrame, fishing_trips: DataFrame
+) -> DataFrame:
+    """
+    Marks AIS data read from file_path with fishing information from
+    the DCA data and fishing trips starting the same day.
+    """
+    # Get date from AIS filename and, filter DCA data and fishing trips
+    ais_date = os.path.basename(file_path)[4:-4]
+    dca_slice = dca_data.where(
+        dca_data["Starttidspunkt"].dt.date
+        == datetime.strptime(ais_date, "%Y%m%d").date()
+    ).dropna()
+    fish_trip_slice = fishing_trips.where(
+        fishing_trips["Avgangstidspunkt"].dt.date
+        == datetime.strptime(ais_date, "%Y%m%d").date()
+    ).dropna()
+
+    return _apply_marks(ais_data, dca_slice, fish_trip_slice)
+
+
 def process_ais(
-    file_path: str, dca_data: DataFrame, fishing_trips: DataFrame
+    file_path: str,
+    dca_data: DataFrame,
+    fishing_trips: DataFrame,
+    telemetry: Telemetry | None = None,
+    clean: bool = False,
+    max_speed: float = MAX_SPEED_KNOTS,
 ) -> DataFrame:
     """
     Process a single compressed zip file with ais data,
@@ -126,58 +203,215 @@ def process_ais(
     file_path: path to AIS data
     dca_data: dataframe with dca data
     fishing_trips: dataframe with fishing trip data
+    telemetry: optional telemetry to measure reading and marking
+    clean: clean the AIS data with clean_ais before marking
+    max_speed: speed in knots above which pings are dropped when cleaning
     """
-    # Read AIS file
-    column_dtypes = {
-        "mmsi": int,
-        "date_time_utc": object,
-        "lon": float,
-        "lat": float,
-        "sog": float,
-        "cog": float,
-        "true_heading": int,
-        "nav_status": int,
-        "message_nr": int,
-    }
-    ais_data = pd.read_csv(file_path, sep=";", dtype=column_dtypes, compression="zip")
-    ais_data["date_time_utc"] = pd.to_datetime(ais_data["date_time_utc"])
+    if telemetry is None:
+        telemetry = Telemetry("process_ais")
 
-    # Get date from AIS filename and, filter DCA data and fishing trips
-    ais_date = os.path.basename(file_path)[4:-4]
-    dca_slice = dca_data.where(
-        dca_data["Starttidspunkt"].dt.date
-        == datetime.strptime(ais_date, "%Y%m%d").date()
-    ).dropna()
-    fish_trip_slice = fishing_trips.where(
-        fishing_trips["Avgangstidspunkt"].dt.date
-        == datetime.strptime(ais_date, "%Y%m%d").date()
-    ).dropna()
+    ais_data, _ = _load_ais(file_path, telemetry, clean, max_speed)
 
-    result = _apply_marks(ais_data, dca_slice, fish_trip_slice)
+    with telemetry.stage("mark", rows_in=len(ais_data)) as stage:
+        result = mark_ais(ais_data, file_path, dca_data, fishing_trips)
+        stage.rows_out = len(result)
     return result
 
 
+def _load_ais(
+    file_path: str, telemetry: Telemetry, clean: bool, max_speed: float
+) -> tuple[DataFrame, dict]:
+    """
+    Reads an AIS file, and cleans it if clean is set. Returns the data
+    and the number of rows dropped by each cleaning rule.
+    """
+    with telemetry.stage("read") as stage:
+        ais_data = read_ais(file_path)
+        stage.rows_out = len(ais_data)
+    if not clean:
+        return ais_data, {}
+
+    with telemetry.stage("clean", rows_in=len(ais_data)) as stage:
+        ais_data, dropped = clean_ais(ais_data, max_speed)
+        for rule, rows in dropped.items():
+            stage.metrics[f"dropped_{rule}"] = rows
+        stage.rows_out = len(ais_data)
+    return ais_data, dropped
+
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    """
+    Puts an item in a bounded queue, waiting while it is full.
+    Returns False if the pipeline is stopped before there is room.
+    """
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _read_files(
+    paths: list[str],
+    out: queue.Queue,
+    stop: threading.Event,
+    telemetry: Telemetry,
+    busy: dict,
+    clean: bool,
+    max_speed: float,
+    dropped: dict,
+) -> None:
+    """
+    Reads and cleans AIS files in order and puts them in the out queue,
+    followed by _DONE. Errors are passed on through the queue.
+    """
+    try:
+        for path in paths:
+            start = time.perf_counter()
+            ais_data, file_dropped = _load_ais(path, telemetry, clean, max_speed)
+            for rule, rows in file_dropped.items():
+                dropped[rule] += rows
+            busy["read"] += time.perf_counter() - start
+            if not _put(out, (path, ais_data), stop):
+                return
+    except Exception as e:
+        _put(out, e, stop)
+        return
+    _put(out, _DONE, stop)
+
+
+def _write_files(
+    inp: queue.Queue,
+    stop: threading.Event,
+    telemetry: Telemetry,
+    busy: dict,
+    errors: list,
+) -> None:
+    """
+    Writes marked AIS data from the in queue to parquet files until _DONE.
+    Errors stop the pipeline and are stored in errors.
+    """
+    while True:
+        item = inp.get()
+        if item is _DONE:
+            return
+        ais_df, target = item
+        start = time.perf_counter()
+        try:
+            with telemetry.stage("write", rows_in=len(ais_df)):
+                ais_df.to_parquet(target)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+            return
+        busy["write"] += time.perf_counter() - start
+
+
 def process_ais_folder(
     ais_data_path: str,
     dca_date_slice: DataFrame,
     fishing_trips: DataFrame,
     save_destination: str,
+    telemetry: Telemetry | None = None,
+    prefetch: int = 2,
+    clean: bool = False,
+    max_speed: float = MAX_SPEED_KNOTS,
 ):
     """
     Reads all files from folder containing AIS data, marks fishing status,\
-    and saves to destination.
+    and saves to destination. With clean, files are cleaned with clean_ais
+    before marking, and the rows dropped by each rule are printed.
+
+    Files are read and decompressed in one thread and written in another,
+    while they are marked in the calling thread, so reading, marking and
+    writing of different days overlap. At most prefetch files wait to be
+    marked and to be written, which bounds memory use. The share of the
+    time each step is busy is printed, and added to telemetry.
     """
-    ais_list = os.listdir(ais_data_path)
-    for i, ais_day in enumerate(ais_list):
-        if ais_day.endswith(".zip"):
-            print(i, end=" ")
-            ais_df = process_ais(
-                os.path.join(ais_data_path, ais_day), dca_date_slice, fishing_trips
-            )
-            filename = f"{ais_day[:-4]}"
-            if not os.path.exists(save_destination):
-                os.mkdir(save_destination)
-            ais_df.to_parquet(f"{save_destination}/{filename}.parquet")
+    if telemetry is None:
+        telemetry = Telemetry("process_ais")
+    if not os.path.exists(save_destination):
+        os.mkdir(save_destination)
+    paths = [
+        os.path.join(ais_data_path, ais_day)
+        for ais_day in os.listdir(ais_data_path)
+        if ais_day.endswith(".zip")
+    ]
+
+    busy = {"read": 0.0, "mark": 0.0, "write": 0.0}
+    dropped = {rule: 0 for rule in RULES}
+    errors = []
+    read_queue = queue.Queue(maxsize=prefetch)
+    write_queue = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+    reader = threading.Thread(
+        target=_read_files,
+        args=(paths, read_queue, stop, telemetry, busy, clean, max_speed, dropped),
+        daemon=True,
+    )
+    writer = threading.Thread(
+        target=_write_files,
+        args=(write_queue, stop, telemetry, busy, errors),
+        daemon=True,
+    )
+
+    with telemetry.stage("folder", rows_in=len(paths)) as stage:
+        folder_start = time.perf_counter()
+        reader.start()
+        writer.start()
+        try:
+            i = 0
+            while not errors:
+                try:
+                    item = read_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is _DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                path, ais_data = item
+                print(i, end=" ")
+                i += 1
+
+                start = time.perf_counter()
+                with telemetry.stage("mark", rows_in=len(ais_data)) as mark_stage:
+                    ais_df = mark_ais(ais_data, path, dca_date_slice, fishing_trips)
+                    mark_stage.rows_out = len(ais_df)
+                busy["mark"] += time.perf_counter() - start
+
+                filename = os.path.basename(path)[:-4]
+                target = f"{save_destination}/{filename}.parquet"
+                if not _put(write_queue, (ais_df, target), stop):
+                    break
+        finally:
+            # Stop reading, and let the writer finish the queued files
+            stop.set()
+            while writer.is_alive():
+                try:
+                    write_queue.put(_DONE, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            writer.join()
+            reader.join()
+        if errors:
+            raise errors[0]
+
+        elapsed = time.perf_counter() - folder_start
+        for name, seconds in busy.items():
+            stage.metrics[f"{name}_busy_s"] = seconds
+        utilization = ", ".join(
+            f"{name} {seconds / elapsed:.0%}" for name, seconds in busy.items()
+        )
+    print(f"\nBusy time: {utilization}")
+    if clean:
+        print(
+            "Dropped rows: "
+            + ", ".join(f"{rule} {rows}" for rule, rows in dropped.items())
+        )
 
 
 def unzip_ais(file_path: str, destination: str | None = None) -> None:
@@ -204,16 +438,31 @@ def zip_ais_directory(dir_to_zip: str, destination: str) -> None:
 
 
 def main(args) -> None:
+    telemetry = Telemetry.from_args("process_ais", args)
+    with telemetry.stage("check_mmsi") as stage:
+        ambiguous = ambiguous_mappings(read_mmsi_mapping(args.mmsi_path))
+        stage.metrics["ambiguous_call_signs"] = ambiguous["kallesignal"].nunique()
+    if len(ambiguous) > 0:
+        print(
+            f"{ambiguous['kallesignal'].nunique()} call signs map to several mmsi"
+            " at the same time, the mapping that started last is used:"
+        )
+        print(ambiguous.to_string(index=False))
+    with telemetry.stage("load_dca") as stage:
+        dca_data = get_dca_with_mmsi(args.dca_path, args.mmsi_path)
+        stage.rows_out = len(dca_data)
+    with telemetry.stage("load_trips") as stage:
+        fishing_trips = get_fish_trips_with_mmsi(args.f_trips_path, args.mmsi_path)
+        stage.rows_out = len(fishing_trips)
 
-    dca_data = get_dca_with_mmsi(args.dca_path, args.mmsi_path)
-    fishing_trips = get_fish_trips_with_mmsi(args.f_trips_path, args.mmsi_path)
     if args.is_dir:
         # Unzip
         print("Unzipping...")
-        for ais_zip in os.listdir(args.path):
-            if ais_zip.endswith(".zip"):
-                unzip_ais(os.path.join(args.path, ais_zip))
-                print(f"Unzipped {ais_zip}")
+        with telemetry.stage("unzip"):
+            for ais_zip in os.listdir(args.path):
+                if ais_zip.endswith(".zip"):
+                    unzip_ais(os.path.join(args.path, ais_zip))
+                    print(f"Unzipped {ais_zip}")
 
         # Read and process
         print("Processing and marking...")
@@ -221,23 +470,46 @@ def main(args) -> None:
             if ais_dir.startswith("AIS") and not ais_dir.endswith(".zip"):
                 filepath_dir = os.path.join(args.path, ais_dir)
                 target_dir = os.path.join(args.target_dir, ais_dir)
-                process_ais_folder(filepath_dir, dca_data, fishing_trips, target_dir)
+                process_ais_folder(
+                    filepath_dir,
+                    dca_data,
+                    fishing_trips,
+                    target_dir,
+                    telemetry,
+                    args.prefetch,
+                    args.clean,
+                    args.max_speed,
+                )
                 print(f"Finished marking {ais_dir}.")
                 if args.zip:
-                    zip_ais_directory(target_dir, f"{target_dir}.zip")
+                    with telemetry.stage("zip"):
+                        zip_ais_directory(target_dir, f"{target_dir}.zip")
                     print(f"Rezipped {target_dir}")
 
     else:
         print("Unzipping...")
-        unzip_ais(args.path)
+        with telemetry.stage("unzip"):
+            unzip_ais(args.path)
         ais_dir = args.path[:-4]
         print("Processing and marking...")
-        process_ais_folder(ais_dir, dca_data, fishing_trips, args.target_dir)
+        process_ais_folder(
+            ais_dir,
+            dca_data,
+            fishing_trips,
+            args.target_dir,
+            telemetry,
+            args.prefetch,
+            args.clean,
+            args.max_speed,
+        )
         if args.zip:
             print("Zipping...")
-            zip_ais_directory(args.target_dir, f"{args.target_dir}.zip")
+            with telemetry.stage("zip"):
+                zip_ais_directory(args.target_dir, f"{args.target_dir}.zip")
 
     print("Done!")
+    telemetry.print_summary()
+    telemetry.write_report()
 
 
 if __name__ == "__main__":
@@ -256,12 +528,33 @@ if __name__ == "__main__":
         "--f_trips_path", help="Path to fishing trips data", required=True
     )
     parser.add_argument(
-        "--mmsi_path", help="Path to MMSI data in xlsx format", required=True
+        "--mmsi_path",
+        help="Path to MMSI data in xlsx or csv format, with the columns mmsi and\
+        kallesignal, and optionally valid_from and valid_to",
+        required=True,
     )
     parser.add_argument(
         "-d", "--is_dir", action="store_true", help="Read a directory instead of a file"
     )
     parser.add_argument("-z", "--zip", action="store_true", help="Zip marked AIS data")
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=2,
+        help="Number of files read ahead of marking, and waiting to be written",
+    )
+    parser.add_argument(
+        "--clean",
+        action="store_true",
+        help="Drop duplicate pings and position jumps before marking",
+    )
+    parser.add_argument(
+        "--max_speed",
+        type=float,
+        default=MAX_SPEED_KNOTS,
+        help="Speed in knots above which position jumps are dropped by --clean",
+    )
+    add_telemetry_arguments(parser)
     args = parser.parse_args()
 
     main(args)
@@ -4,13 +4,22 @@ import os
 
 import numpy as np
 import pandas as pd
+from arrow_io import write_arrow
 from pandas import DataFrame
+from schema import read_ers_csv, read_ers_folder
+from telemetry import Telemetry, add_telemetry_arguments
+from timestamps import TimestampParser
 
 
-def process_dca_data(dca_data: DataFrame) -> DataFrame:
+def process_dca_data(
+    dca_data: DataFrame, telemetry: Telemetry | None = None
+) -> DataFrame:
     """
     Reduces and transforms DCA data.
+    Stages are measured with telemetry if it is given.
     """
+    if telemetry is None:
+        telemetry = Telemetry("process_dca")
 
     keep_columns = [
         "Melding ID",
@@ -38,21 +47,23 @@ def process_dca_data(dca_data: DataFrame) -> DataFrame:
         "Hovedområde stopp",
     ]
 
-    reduced_data = dca_data[keep_columns]
+    with telemetry.stage("reduce", rows_in=len(dca_data)) as stage:
+        reduced_data = dca_data[keep_columns]
 
-    # Keep only OTB (bottom trawl) and drop rows with no species information
-    reduced_data = reduced_data.where(reduced_data["Redskap FAO (kode)"] == "OTB")
-    reduced_data = reduced_data.dropna(subset=["Art FAO"])
+        # Keep only OTB (bottom trawl) and drop rows with no species information
+        reduced_data = reduced_data.where(reduced_data["Redskap FAO (kode)"] == "OTB")
+        reduced_data = reduced_data.dropna(subset=["Art FAO"])
 
-    # Sum the round weights for message id, start time, and stop time
-    catch_sums = reduced_data.groupby(
-        ["Melding ID", "Starttidspunkt", "Stopptidspunkt"]
-    )["Rundvekt"].sum()
+        # Sum the round weights for message id, start time, and stop time
+        catch_sums = reduced_data.groupby(
+            ["Melding ID", "Starttidspunkt", "Stopptidspunkt"]
+        )["Rundvekt"].sum()
 
-    # Check for duplicates
-    reduced_data.duplicated(
-        ["Melding ID", "Starttidspunkt", "Stopptidspunkt", "Art FAO"]
-    ).sum()
+        # Check for duplicates
+        reduced_data.duplicated(
+            ["Melding ID", "Starttidspunkt", "Stopptidspunkt", "Art FAO"]
+        ).sum()
+        stage.rows_out = len(reduced_data)
 
     # Create columns of round weight for each of 14 fish species + column for rest
     top_species = [
@@ -71,89 +82,104 @@ def process_dca_data(dca_data: DataFrame) -> DataFrame:
         "Kveite",
         "Lyr",
     ]
-    reduced_data = reduced_data.loc[reduced_data["Art FAO"].isin(top_species)]
-    reduced_data_pivot = reduced_data.pivot(
-        index=["Melding ID", "Starttidspunkt", "Stopptidspunkt"],
-        columns="Art FAO",
-        values="Rundvekt",
-    ).reset_index()
-    reduced_data_weight = reduced_data_pivot.merge(
-        catch_sums, on=["Melding ID", "Starttidspunkt", "Stopptidspunkt"]
-    )
-
-    reduced_data_weight["ANDRE"] = reduced_data_weight.apply(
-        lambda row: row["Rundvekt"] - row[top_species].sum(), axis=1
-    )
-    reduced_data_weight[top_species] = reduced_data_weight[top_species].replace(
-        np.nan, 0
-    )
-
-    reduced_data = reduced_data.drop(columns=["Art FAO", "Rundvekt"]).drop_duplicates()
-
-    # Merge datasets and combine tonnage columns
-    complete_data = reduced_data.merge(
-        reduced_data_weight, on=["Melding ID", "Starttidspunkt", "Stopptidspunkt"]
-    )
-    complete_data[["Bruttotonnasje 1969", "Bruttotonnasje annen"]] = complete_data[
-        ["Bruttotonnasje 1969", "Bruttotonnasje annen"]
-    ].replace(np.nan, 0)
-    complete_data["Bruttotonnasje"] = complete_data.apply(
-        lambda row: row["Bruttotonnasje 1969"] + row["Bruttotonnasje annen"], axis=1
-    )
-    complete_data.drop(
-        columns=["Bruttotonnasje 1969", "Bruttotonnasje annen"], inplace=True
-    )
-
-    complete_data = complete_data.sort_values(
-        ["Meldingstidspunkt", "Starttidspunkt"], ignore_index=True
-    )
-
-    # message_ids = complete_data["Melding ID"].unique()
-    call_signs = complete_data["Radiokallesignal (ERS)"].unique()
-    complete_data["Starttidspunkt"] = pd.to_datetime(
-        complete_data["Starttidspunkt"], format="mixed", dayfirst=True
-    )
-    complete_data["Stopptidspunkt"] = pd.to_datetime(
-        complete_data["Stopptidspunkt"], format="mixed", dayfirst=True
-    )
-
-    # Drop time overlapping messages for each vessel
-    all_messages = []
-    for c_sign in call_signs:
-        messages = complete_data.where(
-            complete_data["Radiokallesignal (ERS)"] == c_sign
-        ).dropna(how="all")
-        i = 0
-        len_df = len(messages)
-        while i < len_df - 1:
-            # Message ID can be same or different
-            if (
-                messages.iloc[i + 1]["Starttidspunkt"]
-                < messages.iloc[i]["Stopptidspunkt"]
-                and messages.iloc[i + 1]["Starttidspunkt"]
-                >= messages.iloc[i]["Starttidspunkt"]
-            ):
-                messages = messages.drop(messages.index[i + 1], inplace=False)
-                len_df -= 1
-            i += 1
-        all_messages.append(messages)
-
-    complete_data_no_dupes = pd.concat(all_messages)
-
-    complete_data_no_dupes["Trekkavstand"] = complete_data_no_dupes[
-        "Trekkavstand"
-    ].replace(np.nan, 0)
-
-    # Drop rows where area is nan
-    complete_data_no_dupes = complete_data_no_dupes.dropna(
-        subset=["Hovedområde start", "Hovedområde stopp"]
-    )
-
-    df = complete_data_no_dupes
-    df = df.sort_values("Starttidspunkt")
-    df["Meldingstidspunkt"] = pd.to_datetime(
-        df["Meldingstidspunkt"], format="mixed", dayfirst=True
-    )
+    with telemetry.stage("pivot_species", rows_in=len(reduced_data)) as stage:
+        reduced_data = reduced_data.loc[reduced_data["Art FAO"].isin(top_species)]
+        reduced_data_pivot = reduced_data.pivot(
+            index=["Melding ID", "Starttidspunkt", "Stopptidspunkt"],
+            columns="Art FAO",
+            values="Rundvekt",
+        ).reset_index()
+        reduced_data_weight = reduced_data_pivot.merge(
+            catch_sums, on=["Melding ID", "Starttidspunkt", "Stopptidspunkt"]
+        )
+
+        reduced_data_weight["ANDRE"] = reduced_data_weight.apply(
+            lambda row: row["Rundvekt"] - row[top_species].sum(), axis=1
+        )
+        reduced_data_weight[top_species] = reduced_data_weight[top_species].replace(
+            np.nan, 0
+        )
+
+        reduced_data = reduced_data.drop(
+            columns=["Art FAO", "Rundvekt"]
+        ).drop_duplicates()
+        stage.rows_out = len(reduced_data_weight)
+
+    with telemetry.stage("merge", rows_in=len(reduced_data)) as stage:
+        # Merge datasets and combine tonnage columns
+        complete_data = reduced_data.merge(
+            reduced_data_weight, on=["Melding ID", "Starttidspunkt", "Stopptidspunkt"]
+        )
+        complete_data[["Bruttotonnasje 1969", "Bruttotonnasje annen"]] = complete_data[
+            ["Bruttotonnasje 1969", "Bruttotonnasje annen"]
+        ].replace(np.nan, 0)
+        complete_data["Bruttotonnasje"] = complete_data.apply(
+            lambda row: row["Bruttotonnasje 1969"] + row["Bruttotonnasje annen"], axis=1
+        )
+        complete_data.drop(
+            columns=["Bruttotonnasje 1969", "Bruttotonnasje annen"], inplace=True
+        )
+
+        complete_data = complete_data.sort_values(
+            ["Meldingstidspunkt", "Starttidspunkt"], ignore_index=True
+        )
+        stage.rows_out = len(complete_data)
+
+    with telemetry.stage("parse_dates", rows_in=len(complete_data)) as stage:
+        # message_ids = complete_data["Melding ID"].unique()
+        call_signs = complete_data["Radiokallesignal (ERS)"].unique()
+        parser = TimestampParser()
+        complete_data["Starttidspunkt"] = parser.parse(complete_data["Starttidspunkt"])
+        complete_data["Stopptidspunkt"] = parser.parse(complete_data["Stopptidspunkt"])
+        stage.metrics["timestamp_fallback_rows"] = parser.fallback_rows
+        stage.rows_out = len(complete_data)
+
+    with telemetry.stage("drop_overlaps", rows_in=len(complete_data)) as stage:
+        # Drop time overlapping messages for each vessel
+        all_messages = []
+        for c_sign in call_signs:
+            messages = complete_data.where(
+                complete_data["Radiokallesignal (ERS)"] == c_sign
+            ).dropna(how="all")
+            i = 0
+            len_df = len(messages)
+            while i < len_df - 1:
+                # Message ID can be same or different
+                if (
+                    messages.iloc[i + 1]["Starttidspunkt"]
+                    < messages.iloc[i]["Stopptidspunkt"]
+                    and messages.iloc[i + 1]["Starttidspunkt"]
+                    >= messages.iloc[i]["Starttidspunkt"]
+                ):
+                    messages = messages.drop(messages.index[i + 1], inplace=False)
+                    len_df -= 1
+                i += 1
+            all_messages.append(messages)
+
+        complete_data_no_dupes = pd.concat(all_messages)
+
+        complete_data_no_dupes["Trekkavstand"] = complete_data_no_dupes[
+            "Trekkavstand"
+        ].replace(np.nan, 0)
+
+        # Drop rows where area is nan
+        complete_data_no_dupes = complete_data_no_dupes.dropna(
+            subset=["Hovedområde start", "Hovedområde stopp"]
+        )
+        stage.rows_out = len(complete_data_no_dupes)
+
+    with telemetry.stage("finalize", rows_in=len(complete_data_no_dupes)) as stage:
+        df = complete_data_no_dupes
+        df = df.sort_values("Starttidspunkt")
+        fallback_rows = parser.fallback_rows
+        df["Meldingstidspunkt"] = parser.parse(df["Meldingstidspunkt"])
+        stage.metrics["timestamp_fallback_rows"] = parser.fallback_rows - fallback_rows
+
+    if parser.fallback_rows > 0:
+        print(
+            f"{parser.fallback_rows} of {parser.rows} timestamps"
+            " did not match the dominant format"
+        )
 
     return df
 
@@ -184,27 +210,25 @@ def save_by_month(df: DataFrame, column: str, dest: str) -> None:
 
 
 def main(args) -> None:
-    if args.is_dir:
-        dca_frames = []
-        for dca_file in os.listdir(args.path):
-            if dca_file.endswith(".csv"):
-                df = pd.read_csv(
-                    os.path.join(args.path, dca_file),
-                    sep=";",
-                    decimal=",",
-                    low_memory=False,
-                )
-                dca_frames.append(df)
-
-        dca_data = pd.concat(dca_frames)
-    else:
-        dca_data = pd.read_csv(args.path, sep=";", decimal=",")
-
-    my_data = process_dca_data(dca_data)
+    telemetry = Telemetry.from_args("process_dca", args)
+    with telemetry.stage("read") as stage:
+        if args.is_dir:
+            dca_data = read_ers_folder(args.path, "dca")
+        else:
+            dca_data = read_ers_csv(args.path, "dca")
+        stage.rows_out = len(dca_data)
+
+    my_data = process_dca_data(dca_data, telemetry)
     if args.combine:
-        my_data.to_csv(os.path.join(args.target_dir, "combined.csv"), index=False)
+        with telemetry.stage("write_combined", rows_in=len(my_data)):
+            my_data.to_csv(os.path.join(args.target_dir, "combined.csv"), index=False)
+            write_arrow(my_data, os.path.join(args.target_dir, "combined.arrow"))
+
+    with telemetry.stage("write_months", rows_in=len(my_data)):
+        save_by_month(my_data, "Starttidspunkt", dest=args.target_dir)
 
-    save_by_month(my_data, "Starttidspunkt", dest=args.target_dir)
+    telemetry.print_summary()
+    telemetry.write_report()
 
 
 if __name__ == "__main__":
@@ -222,8 +246,10 @@ if __name__ == "__main__":
         "-c",
         "--combine",
         action="store_true",
-        help="Save an additional file with all data combined in one csv file.",
+        help="Save additional files with all data combined in one csv file,\
+        and in one Arrow file.",
     )
+    add_telemetry_arguments(parser)
     args = parser.parse_args()
 
     main(args)
@@ -1,25 +1,33 @@
 #!/usr/bin/env python3
 import argparse
-import os
 
 import numpy as np
 import pandas as pd
+from arrow_io import arrow_path, write_arrow
 from pandas import DataFrame, Series
+from schema import read_ers_folder
+from telemetry import Telemetry, add_telemetry_arguments
+from timestamps import TimestampParser
 
 
-def read_and_combine(data_folder: str) -> DataFrame:
+def read_and_combine(data_folder: str, message_type: str) -> DataFrame:
     """
-    Read all data from a data folder, and combine it into a single dataframe.
+    Read all data of a message type (dep or por) from a data folder,
+    and combine it into a single dataframe.
     """
-    dframes = []
-    for file in os.listdir(data_folder):
-        if file.endswith(".csv"):
-            df = pd.read_csv(os.path.join(data_folder, file), sep=";", low_memory=False)
-            dframes.append(df)
-    return pd.concat(dframes)
+    return read_ers_folder(data_folder, message_type)
 
 
-def prepare_data(df, time_column: str) -> DataFrame:
+def prepare_data(
+    df, time_column: str, parser: TimestampParser | None = None
+) -> DataFrame:
+    """
+    Selects the columns used to define fishing trips, and parses the
+    time column. A parser can be shared between calls, to reuse parsed
+    timestamps and count the rows parsed with the fallback format.
+    """
+    if parser is None:
+        parser = TimestampParser()
     columns = [
         "Melding ID",
         "Radiokallesignal (ERS)",
@@ -29,7 +37,7 @@ def prepare_data(df, time_column: str) -> DataFrame:
         "Rundvekt",
     ]
     df = df[columns].drop_duplicates()
-    df[time_column] = pd.to_datetime(df[time_column], dayfirst=True, format="mixed")
+    df[time_column] = parser.parse(df[time_column])
     return df
 
 
@@ -170,10 +178,37 @@ def define_fishing_trips_all_vessels(
 
 
 def main(args) -> None:
-    dep_data = prepare_data(read_and_combine(args.dep_path), "Avgangstidspunkt")
-    por_data = prepare_data(read_and_combine(args.por_path), "Ankomsttidspunkt")
-    trips = define_fishing_trips_all_vessels(dep_data, por_data)
-    trips.to_csv(args.target_csv, index=False)
+    telemetry = Telemetry.from_args("process_fishing_trips", args)
+    with telemetry.stage("read") as stage:
+        dep_data = read_and_combine(args.dep_path, "dep")
+        por_data = read_and_combine(args.por_path, "por")
+        stage.rows_out = len(dep_data) + len(por_data)
+
+    with telemetry.stage("parse_dates", rows_in=len(dep_data) + len(por_data)) as stage:
+        parser = TimestampParser()
+        dep_data = prepare_data(dep_data, "Avgangstidspunkt", parser)
+        por_data = prepare_data(por_data, "Ankomsttidspunkt", parser)
+        stage.metrics["timestamp_fallback_rows"] = parser.fallback_rows
+        stage.rows_out = len(dep_data) + len(por_data)
+    if parser.fallback_rows > 0:
+        print(
+            f"{parser.fallback_rows} of {parser.rows} timestamps"
+            " did not match the dominant format"
+        )
+
+    with telemetry.stage(
+        "define_trips", rows_in=len(dep_data) + len(por_data)
+    ) as stage:
+        trips = define_fishing_trips_all_vessels(dep_data, por_data)
+        stage.rows_out = len(trips)
+
+    with telemetry.stage("write", rows_in=len(trips)):
+        trips.to_csv(args.target_csv, index=False)
+        # Trips are built from transposed rows, so columns are objects
+        write_arrow(trips.infer_objects(), arrow_path(args.target_csv))
+
+    telemetry.print_summary()
+    telemetry.write_report()
 
 
 if __name__ == "__main__":
@@ -183,7 +218,12 @@ if __name__ == "__main__":
     )
     parser.add_argument("dep_path", help="Path to directory containing DEP data")
     parser.add_argument("por_path", help="Path to directory containing POR data")
-    parser.add_argument("target_csv", help="Path to csv file where results are stored")
+    parser.add_argument(
+        "target_csv",
+        help="Path to csv file where results are stored. The results are\
+        also stored in an Arrow file next to it.",
+    )
+    add_telemetry_arguments(parser)
     args = parser.parse_args()
 
     main(args)
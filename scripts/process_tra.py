@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+import argparse
+
+import pandas as pd
+from arrow_io import arrow_path, read_table, write_arrow
+from pandas import DataFrame
+from schema import FISHING_TRIPS, read_ers_folder
+from telemetry import Telemetry, add_telemetry_arguments
+from timestamps import TimestampParser
+
+VESSEL_COLUMN = "Radiokallesignal (ERS)"
+
+# Columns of TRA messages used to match transfers to trips
+COLUMNS = ["Melding ID", "Meldingstidspunkt", VESSEL_COLUMN, "Rundvekt"]
+
+
+def match_transfers(transfers: DataFrame, trips: DataFrame) -> DataFrame:
+    """
+    Matches each transfer to the fishing trip of the same vessel that was
+    ongoing at the time of the transfer, with an as-of join on departure
+    time followed by a check of the arrival time. Transfers outside of
+    every trip get no trip_id.
+
+    Parameters:
+    -----------
+    transfers: TRA data with parsed Meldingstidspunkt
+    trips: fishing trips with parsed Avgangstidspunkt and Ankomsttidspunkt
+    """
+    trips = trips[[VESSEL_COLUMN, "Avgangstidspunkt", "Ankomsttidspunkt", "trip_id"]]
+    trips = trips.astype({VESSEL_COLUMN: transfers[VESSEL_COLUMN].dtype})
+    matched = pd.merge_asof(
+        transfers.dropna(subset=["Meldingstidspunkt", VESSEL_COLUMN]).sort_values(
+            "Meldingstidspunkt"
+        ),
+        trips.dropna(subset=["Avgangstidspunkt"]).sort_values("Avgangstidspunkt"),
+        left_on="Meldingstidspunkt",
+        right_on="Avgangstidspunkt",
+        by=VESSEL_COLUMN,
+        direction="backward",
+    )
+    after_arrival = matched["Meldingstidspunkt"] > matched["Ankomsttidspunkt"]
+    matched.loc[after_arrival, "trip_id"] = None
+    return matched.drop(columns=["Avgangstidspunkt", "Ankomsttidspunkt"])
+
+
+def transfer_totals(matched: DataFrame) -> DataFrame:
+    """
+    Sums the transfers matched to each trip. Returns the number of transfer
+    messages and the transferred round weight per trip_id.
+    """
+    return (
+        matched.dropna(subset=["trip_id"])
+        .groupby("trip_id", as_index=False)
+        .agg(
+            transfers=("Melding ID", "nunique"),
+            transferred_weight=("Rundvekt", "sum"),
+        )
+    )
+
+
+def main(args) -> None:
+    telemetry = Telemetry.from_args("process_tra", args)
+    with telemetry.stage("read") as stage:
+        transfers = read_ers_folder(args.tra_path, "tra", usecols=COLUMNS)
+        trips = read_table(args.f_trips_path, dtype=FISHING_TRIPS)
+        stage.rows_out = len(transfers)
+
+    with telemetry.stage("parse_dates", rows_in=len(transfers)) as stage:
+        parser = TimestampParser()
+        transfers["Meldingstidspunkt"] = parser.parse(transfers["Meldingstidspunkt"])
+        trip_times = trips.assign(
+            Avgangstidspunkt=pd.to_datetime(trips["Avgangstidspunkt"]),
+            Ankomsttidspunkt=pd.to_datetime(trips["Ankomsttidspunkt"]),
+        )
+        stage.metrics["timestamp_fallback_rows"] = parser.fallback_rows
+        stage.rows_out = len(transfers)
+
+    with telemetry.stage("match", rows_in=len(transfers)) as stage:
+        matched = match_transfers(transfers, trip_times)
+        totals = transfer_totals(matched)
+        unmatched = int(matched["trip_id"].isna().sum())
+        stage.metrics["unmatched_rows"] = unmatched
+        stage.rows_out = len(totals)
+
+    with telemetry.stage("join", rows_in=len(totals)) as stage:
+        totals["trip_id"] = totals["trip_id"].astype(trips["trip_id"].dtype)
+        enriched = trips.merge(totals, on="trip_id", how="left")
+        # Trips without transfers have transferred nothing
+        enriched["transfers"] = enriched["transfers"].fillna(0).astype("int64")
+        enriched["transferred_weight"] = enriched["transferred_weight"].fillna(0.0)
+        stage.rows_out = len(enriched)
+
+    with telemetry.stage("write", rows_in=len(enriched)):
+        enriched.to_csv(args.target_csv, index=False)
+        write_arrow(enriched, arrow_path(args.target_csv))
+
+    print(
+        f"Matched {len(matched) - unmatched} of {len(matched)} transfer rows"
+        f" to {len(totals)} of {len(trips)} trips"
+    )
+    telemetry.print_summary()
+    telemetry.write_report()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Matches TRA (transfer) messages to fishing trips,\
+        and adds the transfer totals of each trip to the fishing trips."
+    )
+    parser.add_argument("tra_path", help="Path to directory containing TRA data")
+    parser.add_argument(
+        "f_trips_path", help="Path to fishing trips data from process_fishing_trips.py"
+    )
+    parser.add_argument(
+        "target_csv",
+        help="Path to csv file where the trips with transfer totals are stored.\
+        The trips are also stored in an Arrow file next to it.",
+    )
+    add_telemetry_arguments(parser)
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,124 @@
+import os
+
+import pandas as pd
+from pandas import DataFrame
+
+# Strings are stored in Arrow arrays instead of Python objects. Codes with
+# few distinct values that are only used for filtering are categoricals.
+# Measurements are float32, except round weights and tonnages, which are
+# summed and written to the results, where float32 sums are off in the last
+# digits.
+STRING = "string[pyarrow]"
+CATEGORY = "category"
+
+# Columns shared by all ERS message types. Timestamps are read as
+# strings and parsed after reading, as they come in mixed formats.
+COMMON = {
+    "Melding ID": "Int64",
+    "Meldingstidspunkt": STRING,
+    "Radiokallesignal (ERS)": STRING,
+    "Fartøynavn (ERS)": STRING,
+    "Art FAO (kode)": STRING,
+    "Art FAO": STRING,
+    "Rundvekt": "float64",
+}
+
+DCA = {
+    **COMMON,
+    "Starttidspunkt": STRING,
+    "Stopptidspunkt": STRING,
+    "Varighet": "Int32",
+    "Startposisjon bredde": "float64",
+    "Startposisjon lengde": "float64",
+    "Havdybde start": "float32",
+    "Stopposisjon bredde": "float64",
+    "Stopposisjon lengde": "float64",
+    "Havdybde stopp": "float32",
+    "Trekkavstand": "float32",
+    "Redskap FAO (kode)": CATEGORY,
+    "Hovedart FAO": STRING,
+    "Bruttotonnasje 1969": "float64",
+    "Bruttotonnasje annen": "float64",
+    "Bredde": "float32",
+    "Fartøylengde": "float32",
+    "Hovedområde start": STRING,
+    "Hovedområde stopp": STRING,
+}
+
+# Kvantum type is grouped on when fishing trips are defined,
+# and is a string so only observed combinations are grouped
+DEP = {
+    **COMMON,
+    "Avgangstidspunkt": STRING,
+    "Havn (kode)": STRING,
+    "Kvantum type (kode)": STRING,
+}
+
+POR = {
+    **COMMON,
+    "Ankomsttidspunkt": STRING,
+    "Havn (kode)": STRING,
+    "Kvantum type (kode)": STRING,
+}
+
+# Transfers are matched on the columns shared by all message types
+TRA = {
+    **COMMON,
+}
+
+# Results of process_fishing_trips.py
+FISHING_TRIPS = {
+    "Radiokallesignal (ERS)": STRING,
+    "Havn_start (kode)": STRING,
+    "Havn_slutt (kode)": STRING,
+    "trip_id": STRING,
+}
+
+SCHEMAS = {"dca": DCA, "dep": DEP, "por": POR, "tra": TRA}
+
+
+def read_ers_csv(
+    path: str, message_type: str, usecols: list[str] | None = None
+) -> DataFrame:
+    """
+    Reads a raw ERS csv file with the dtypes of its message type.
+
+    Parameters:
+    -----------
+    path: path to csv file
+    message_type: one of dca, dep, por and tra
+    usecols: optional columns to read
+    """
+    return pd.read_csv(
+        path,
+        sep=";",
+        decimal=",",
+        dtype=SCHEMAS[message_type],
+        usecols=usecols,
+        low_memory=False,
+    )
+
+
+def read_ers_folder(
+    data_folder: str, message_type: str, usecols: list[str] | None = None
+) -> DataFrame:
+    """
+    Reads all raw ERS csv files of a message type in a folder,
+    and combines them into a single dataframe.
+    """
+    dframes = []
+    for file in os.listdir(data_folder):
+        if file.endswith(".csv"):
+            dframes.append(
+                read_ers_csv(os.path.join(data_folder, file), message_type, usecols)
+            )
+    df = pd.concat(dframes, ignore_index=True)
+
+    # Categoricals with different categories in each file are
+    # combined as objects, and are converted back
+    categories = [
+        column
+        for column, dtype in SCHEMAS[message_type].items()
+        if dtype == CATEGORY and column in df.columns
+    ]
+    return df.astype({column: CATEGORY for column in categories})
@@ -0,0 +1,289 @@
+import argparse
+import cProfile
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    from pyinstrument import Profiler
+except ImportError:
+    Profiler = None
+
+# Seconds between RSS samples while a stage is running
+RSS_INTERVAL = 0.05
+
+
+def _current_rss() -> int | None:
+    """
+    Returns the resident set size of the process in bytes,
+    or None if it can not be read on this platform.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def _peak_rss() -> int:
+    """
+    Returns the peak resident set size of the process in bytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class _RssSampler:
+    """
+    Samples the RSS of the process in a background thread,
+    to find the peak RSS while a stage is running.
+    """
+
+    def __init__(self):
+        self.peak = _current_rss() or 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(RSS_INTERVAL):
+            rss = _current_rss()
+            if rss is not None and rss > self.peak:
+                self.peak = rss
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        rss = _current_rss()
+        if rss is None:
+            # No RSS samples on this platform, use the peak of the process
+            self.peak = _peak_rss()
+        elif rss > self.peak:
+            self.peak = rss
+
+
+class Stage:
+    """
+    Measurements of a single run of a stage. rows_in and rows_out are set
+    by the instrumented code, and other values can be added to metrics.
+    """
+
+    def __init__(self, name: str, rows_in: int | None = None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out: int | None = None
+        self.metrics: dict = {}
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.peak_rss = 0
+
+
+class Telemetry:
+    """
+    Collects stage measurements of a pipeline run. Each stage records
+    wall time, CPU time, peak RSS, rows in and out and throughput.
+    Stages with the same name are summed, so a stage that runs once per
+    file is reported as one stage.
+
+    The CPU time of a stage is that of the thread running it, so stages
+    running at the same time in different threads are measured apart.
+    Work in child processes and in thread pools of libraries is only
+    included in the CPU time of the whole run.
+
+    Example:
+
+        telemetry = Telemetry("process_dca", report_path="report.json")
+        with telemetry.stage("read") as stage:
+            df = pd.read_csv(path)
+            stage.rows_out = len(df)
+        telemetry.write_report()
+
+    Args:
+        name (str) : Name of the run, usually the script name.
+        report_path (str) : Optional path where the JSON report is stored.
+        profile_stage (str) : Optional name of a stage to profile.
+        profiler (str) : Profiler used for profile_stage. (cprofile, pyinstrument)
+    """
+
+    def __init__(
+        self,
+        name: str = "pipeline",
+        report_path: str | None = None,
+        profile_stage: str | None = None,
+        profiler: str = "cprofile",
+    ):
+        self.name = name
+        self.report_path = report_path
+        self.profile_stage = profile_stage
+        self.profiler = profiler
+        self.started = datetime.now()
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+        self._stages: dict[str, dict] = {}
+        self._profile = None
+        self._lock = threading.Lock()
+
+        if profiler == "pyinstrument" and Profiler is None:
+            raise ValueError("pyinstrument is not installed")
+
+    @classmethod
+    def from_args(cls, name: str, args: argparse.Namespace) -> "Telemetry":
+        """
+        Creates telemetry from arguments added with add_telemetry_arguments.
+        """
+        return cls(
+            name,
+            report_path=args.telemetry,
+            profile_stage=args.profile_stage,
+            profiler=args.profiler,
+        )
+
+    @contextmanager
+    def stage(self, name: str, rows_in: int | None = None):
+        """
+        Measures a stage. Yields a Stage where rows_out and
+        additional metrics can be set.
+        """
+        stage = Stage(name, rows_in)
+        profiling = name == self.profile_stage
+        if profiling:
+            self._start_profile()
+        start_wall = time.perf_counter()
+        start_cpu = time.thread_time()
+        try:
+            with _RssSampler() as sampler:
+                yield stage
+        finally:
+            stage.wall = time.perf_counter() - start_wall
+            stage.cpu = time.thread_time() - start_cpu
+            stage.peak_rss = sampler.peak
+            if profiling:
+                self._stop_profile()
+            self.add(stage)
+
+    def add(self, stage: Stage) -> None:
+        """
+        Adds the measurements of a finished stage to the run.
+        """
+        with self._lock:
+            total = self._stages.setdefault(
+                stage.name,
+                {
+                    "calls": 0,
+                    "wall_s": 0.0,
+                    "cpu_s": 0.0,
+                    "peak_rss_mb": 0.0,
+                    "rows_in": None,
+                    "rows_out": None,
+                },
+            )
+            total["calls"] += 1
+            total["wall_s"] += stage.wall
+            total["cpu_s"] += stage.cpu
+            total["peak_rss_mb"] = max(total["peak_rss_mb"], stage.peak_rss / 2**20)
+            for key, rows in [("rows_in", stage.rows_in), ("rows_out", stage.rows_out)]:
+                if rows is not None:
+                    total[key] = (total[key] or 0) + int(rows)
+            for key, value in stage.metrics.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    total[key] = total.get(key, 0) + value
+                else:
+                    total[key] = value
+
+    def _start_profile(self) -> None:
+        if self._profile is None:
+            self._profile = (
+                Profiler() if self.profiler == "pyinstrument" else cProfile.Profile()
+            )
+        if self.profiler == "pyinstrument":
+            self._profile.start()
+        else:
+            self._profile.enable()
+
+    def _stop_profile(self) -> None:
+        if self.profiler == "pyinstrument":
+            self._profile.stop()
+        else:
+            self._profile.disable()
+
+    def report(self) -> dict:
+        """
+        Returns the report of the run.
+        """
+        stages = []
+        with self._lock:
+            for name, total in self._stages.items():
+                rows = (
+                    total["rows_out"] if total["rows_in"] is None else total["rows_in"]
+                )
+                rows_per_s = None
+                if rows is not None and total["wall_s"] > 0:
+                    rows_per_s = rows / total["wall_s"]
+                stages.append({"name": name, **total, "rows_per_s": rows_per_s})
+
+        return {
+            "name": self.name,
+            "started": self.started.isoformat(timespec="seconds"),
+            "wall_s": time.perf_counter() - self._start_wall,
+            "cpu_s": time.process_time() - self._start_cpu,
+            "peak_rss_mb": _peak_rss() / 2**20,
+            "stages": stages,
+        }
+
+    def print_summary(self) -> None:
+        """
+        Prints a short table of the stages.
+        """
+        report = self.report()
+        print(f"{'stage':<20}{'calls':>7}{'wall s':>10}{'cpu s':>10}{'rss MB':>10}")
+        for stage in report["stages"]:
+            print(
+                f"{stage['name']:<20}{stage['calls']:>7}{stage['wall_s']:>10.1f}"
+                f"{stage['cpu_s']:>10.1f}{stage['peak_rss_mb']:>10.0f}"
+            )
+        print(
+            f"Total: {report['wall_s']:.1f} s, peak RSS {report['peak_rss_mb']:.0f} MB"
+        )
+
+    def write_report(self) -> None:
+        """
+        Writes the JSON report, and the profile of profile_stage,
+        if they are enabled.
+        """
+        if self.report_path is not None:
+            with open(self.report_path, "w") as f:
+                json.dump(self.report(), f, indent=2)
+
+        if self._profile is not None:
+            base = self.report_path or f"telemetry_{self.name}.json"
+            base = os.path.splitext(base)[0]
+            if self.profiler == "pyinstrument":
+                with open(f"{base}.{self.profile_stage}.html", "w") as f:
+                    f.write(self._profile.output_html())
+            else:
+                self._profile.dump_stats(f"{base}.{self.profile_stage}.prof")
+
+
+def add_telemetry_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Adds the telemetry arguments shared by the pipeline scripts.
+    """
+    parser.add_argument(
+        "--telemetry", help="Path to JSON file where a report of the run is stored"
+    )
+    parser.add_argument("--profile_stage", help="Name of a stage to profile")
+    parser.add_argument(
+        "--profiler",
+        choices=["cprofile", "pyinstrument"],
+        default="cprofile",
+        help="Profiler used for --profile_stage",
+    )
@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+from pandas import Series
+
+# Formats tried when detecting the format of a column. ERS timestamps are
+# day first, and ISO timestamps are year first, like the mixed format parser.
+FORMATS = [
+    "%d.%m.%Y %H:%M:%S",
+    "%d.%m.%Y %H:%M",
+    "%d.%m.%Y",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%d %H:%M",
+    "%Y-%m-%d",
+]
+
+# Number of distinct values used to detect the format of a column
+SAMPLE_SIZE = 1000
+
+
+def detect_format(values: np.ndarray) -> str | None:
+    """
+    Returns the format in FORMATS that parses most of a sample of the
+    values, or None if none of them parse any value.
+    """
+    sample = values[:SAMPLE_SIZE]
+    best, best_count = None, 0
+    for fmt in FORMATS:
+        count = pd.to_datetime(sample, format=fmt, errors="coerce").notna().sum()
+        if count > best_count:
+            best, best_count = fmt, count
+    return best
+
+
+class TimestampParser:
+    """
+    Parses columns of timestamp strings in the mixed formats found in ERS data.
+
+    Each distinct string is parsed once, and is remembered for the next
+    columns parsed by the same parser. New strings are parsed with the
+    dominant format of the column, and only the strings that do not match
+    it are parsed with the slow mixed format parser. The number of rows
+    parsed with the mixed format parser is counted in fallback_rows.
+
+    Example:
+
+        parser = TimestampParser()
+        df["Starttidspunkt"] = parser.parse(df["Starttidspunkt"])
+        df["Stopptidspunkt"] = parser.parse(df["Stopptidspunkt"])
+        print(parser.fallback_rows)
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.fallback_rows = 0
+        self._known = Series(dtype="datetime64[ns]")
+        self._fallback = Series(dtype=bool)
+
+    def _parse_new(self, strings: np.ndarray) -> None:
+        """
+        Parses strings that have not been seen before, and remembers them.
+        """
+        fmt = detect_format(strings)
+        if fmt is None:
+            parsed = pd.Series(pd.NaT, index=strings, dtype="datetime64[ns]")
+        else:
+            parsed = pd.Series(
+                pd.to_datetime(strings, format=fmt, errors="coerce"), index=strings
+            )
+        fallback = parsed.isna().to_numpy()
+        if fallback.any():
+            parsed.iloc[fallback] = pd.to_datetime(
+                strings[fallback], format="mixed", dayfirst=True
+            )
+        self._known = pd.concat([self._known, parsed])
+        self._fallback = pd.concat([self._fallback, Series(fallback, index=strings)])
+
+    def parse(self, values: Series) -> Series:
+        """
+        Parses a column of timestamp strings. Missing values become NaT.
+        """
+        codes, uniques = pd.factorize(values)
+        uniques = np.asarray(uniques, dtype=object)
+
+        positions = self._known.index.get_indexer(uniques)
+        if (positions < 0).any():
+            self._parse_new(uniques[positions < 0])
+            positions = self._known.index.get_indexer(uniques)
+
+        # Missing values have code -1, and are taken from the NaT at the end
+        parsed = np.append(self._known.to_numpy()[positions], np.datetime64("NaT"))
+        fallback = np.append(self._fallback.to_numpy()[positions], False)
+
+        self.rows += len(values)
+        self.fallback_rows += int(fallback[codes].sum())
+        return Series(parsed[codes], index=values.index, name=values.name)
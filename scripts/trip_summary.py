@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from arrow_io import arrow_path, read_table, write_arrow
+from fishing_effort import MERGE_EVERY, list_marked_ais
+from geo import haversine
+from pandas import DataFrame
+from process_ais import get_fish_trips_with_mmsi
+from schema import FISHING_TRIPS
+from telemetry import Telemetry, add_telemetry_arguments
+
+# Columns of the summary added to the fishing trips
+SUMMARY_COLUMNS = [
+    "distance_km",
+    "fishing_hours",
+    "steaming_hours",
+    "mean_sog_fishing",
+    "lat_min",
+    "lat_max",
+    "lon_min",
+    "lon_max",
+    "ais_pings",
+]
+
+
+def assign_trips(df: DataFrame, trips: DataFrame) -> DataFrame:
+    """
+    Adds the trip_id of the trip each ping belongs to, with an as-of join on
+    mmsi and departure time followed by a check of the arrival time. Pings
+    outside of every trip get no trip_id.
+
+    Parameters:
+    -----------
+    df: AIS data with mmsi and date_time_utc
+    trips: fishing trips with mmsi, from get_fish_trips_with_mmsi
+    """
+    trips = trips[["mmsi", "Avgangstidspunkt", "Ankomsttidspunkt", "trip_id"]]
+    trips = trips.dropna(subset=["Avgangstidspunkt"]).sort_values("Avgangstidspunkt")
+    merged = pd.merge_asof(
+        df.drop(columns="trip_id", errors="ignore")
+        .dropna(subset=["date_time_utc"])
+        .sort_values("date_time_utc"),
+        trips,
+        left_on="date_time_utc",
+        right_on="Avgangstidspunkt",
+        by="mmsi",
+        direction="backward",
+    )
+    after_arrival = ~(merged["date_time_utc"] <= merged["Ankomsttidspunkt"])
+    merged.loc[after_arrival, "trip_id"] = None
+    return merged.drop(columns=["Avgangstidspunkt", "Ankomsttidspunkt"])
+
+
+def summarize_file(path: str, trips: DataFrame) -> tuple[DataFrame, int]:
+    """
+    Summarizes the pings of each trip in a marked AIS file into a partial
+    state, that can be merged with the states of other files by merge_states.
+
+    Pings are assigned to trips by mmsi and time, as process_ais only marks
+    pings with the trips departing on the day of the file, and later days
+    of a trip would be missing.
+
+    The time between two pings of a trip is counted as fishing if the first
+    ping is fishing, and as steaming otherwise. The first and last ping of
+    the trip in the file are kept, so the distance and time between files
+    can be added when states are merged.
+
+    Returns the partial state, and the number of rows read.
+    """
+    df = pq.read_table(
+        path, columns=["mmsi", "date_time_utc", "lon", "lat", "sog", "fishing"]
+    ).to_pandas()
+    rows = len(df)
+    df = assign_trips(df, trips)
+    df = df.dropna(subset=["trip_id", "lon", "lat"])
+    df = df.sort_values(["trip_id", "date_time_utc"], ignore_index=True)
+
+    trip = df["trip_id"].to_numpy()
+    lat = df["lat"].to_numpy()
+    lon = df["lon"].to_numpy()
+    fishing = df["fishing"].to_numpy(dtype=bool)
+
+    # Distance and time from each ping to the next ping of the same trip
+    distance = np.zeros(len(df))
+    hours = np.zeros(len(df))
+    if len(df) > 1:
+        same = trip[1:] == trip[:-1]
+        distance[:-1] = np.where(
+            same, haversine(lat[:-1], lon[:-1], lat[1:], lon[1:]), 0.0
+        )
+        seconds = np.diff(df["date_time_utc"].to_numpy()) / np.timedelta64(1, "s")
+        hours[:-1] = np.where(same, seconds / 3600, 0.0)
+
+    df = df.assign(
+        distance_km=distance,
+        fishing_hours=np.where(fishing, hours, 0.0),
+        steaming_hours=np.where(fishing, 0.0, hours),
+        sog_fishing_sum=np.where(fishing, df["sog"].fillna(0).to_numpy(), 0.0),
+        fishing_pings=fishing.astype(np.int64),
+    )
+    state = df.groupby("trip_id", sort=False).agg(
+        first_time=("date_time_utc", "first"),
+        first_lat=("lat", "first"),
+        first_lon=("lon", "first"),
+        last_time=("date_time_utc", "last"),
+        last_lat=("lat", "last"),
+        last_lon=("lon", "last"),
+        last_fishing=("fishing", "last"),
+        distance_km=("distance_km", "sum"),
+        fishing_hours=("fishing_hours", "sum"),
+        steaming_hours=("steaming_hours", "sum"),
+        sog_fishing_sum=("sog_fishing_sum", "sum"),
+        fishing_pings=("fishing_pings", "sum"),
+        ais_pings=("lat", "size"),
+        lat_min=("lat", "min"),
+        lat_max=("lat", "max"),
+        lon_min=("lon", "min"),
+        lon_max=("lon", "max"),
+    )
+    return state.reset_index(), rows
+
+
+def merge_states(states: list[DataFrame]) -> DataFrame:
+    """
+    Merges partial trip states into one state per trip. The states of a
+    trip are joined in time order, adding the distance and time between
+    the last ping of one state and the first ping of the next. States of
+    a trip must not overlap in time, which holds for daily files.
+    """
+    df = pd.concat(states, ignore_index=True)
+    df = df.sort_values(["trip_id", "first_time"], ignore_index=True)
+
+    # Gaps between consecutive states of the same trip
+    previous = df.shift(1)
+    joined = (df["trip_id"] == previous["trip_id"]).to_numpy(dtype=bool, na_value=False)
+    gap_km = np.where(
+        joined,
+        haversine(
+            previous["last_lat"].to_numpy(dtype=float),
+            previous["last_lon"].to_numpy(dtype=float),
+            df["first_lat"].to_numpy(),
+            df["first_lon"].to_numpy(),
+        ),
+        0.0,
+    )
+    gap_hours = np.where(
+        joined, (df["first_time"] - previous["last_time"]).dt.total_seconds() / 3600, 0
+    )
+    gap_fishing = previous["last_fishing"].to_numpy(dtype=bool, na_value=False)
+    df["distance_km"] += gap_km
+    df["fishing_hours"] += np.where(gap_fishing, gap_hours, 0.0)
+    df["steaming_hours"] += np.where(gap_fishing, 0.0, gap_hours)
+
+    return (
+        df.groupby("trip_id", sort=False)
+        .agg(
+            first_time=("first_time", "first"),
+            first_lat=("first_lat", "first"),
+            first_lon=("first_lon", "first"),
+            last_time=("last_time", "last"),
+            last_lat=("last_lat", "last"),
+            last_lon=("last_lon", "last"),
+            last_fishing=("last_fishing", "last"),
+            distance_km=("distance_km", "sum"),
+            fishing_hours=("fishing_hours", "sum"),
+            steaming_hours=("steaming_hours", "sum"),
+            sog_fishing_sum=("sog_fishing_sum", "sum"),
+            fishing_pings=("fishing_pings", "sum"),
+            ais_pings=("ais_pings", "sum"),
+            lat_min=("lat_min", "min"),
+            lat_max=("lat_max", "max"),
+            lon_min=("lon_min", "min"),
+            lon_max=("lon_max", "max"),
+        )
+        .reset_index()
+    )
+
+
+def summarize_trips(
+    path: str,
+    trips: DataFrame,
+    jobs: int | None = None,
+    telemetry: Telemetry | None = None,
+) -> DataFrame:
+    """
+    Summarizes the marked AIS data of every fishing trip: distance sailed,
+    hours fishing and steaming, mean speed over ground while fishing and
+    bounding box. Files are summarized in parallel, and only one state per
+    trip is kept in memory.
+
+    Parameters:
+    -----------
+    path: directory with marked AIS data
+    trips: fishing trips with mmsi, from get_fish_trips_with_mmsi
+    jobs: number of processes, defaults to the number of CPUs
+    telemetry: optional telemetry to measure summarizing and merging
+    """
+    if telemetry is None:
+        telemetry = Telemetry("trip_summary")
+    files = list_marked_ais(path)
+
+    states = []
+    with telemetry.stage("summarize") as stage:
+        stage.rows_in = 0
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = executor.map(
+                partial(summarize_file, trips=trips), files, chunksize=4
+            )
+            for state, rows in results:
+                stage.rows_in += rows
+                states.append(state)
+                if len(states) >= MERGE_EVERY:
+                    states = [merge_states(states)]
+        stage.metrics["files"] = len(files)
+
+    with telemetry.stage("merge") as stage:
+        if not states:
+            return DataFrame(columns=["trip_id"] + SUMMARY_COLUMNS)
+        summary = merge_states(states)
+        summary["mean_sog_fishing"] = summary["sog_fishing_sum"] / summary[
+            "fishing_pings"
+        ].replace(0, np.nan)
+        summary = summary[["trip_id"] + SUMMARY_COLUMNS]
+        stage.rows_out = len(summary)
+    return summary
+
+
+def main(args) -> None:
+    telemetry = Telemetry.from_args("trip_summary", args)
+    with telemetry.stage("load_trips") as stage:
+        trips_with_mmsi = get_fish_trips_with_mmsi(args.f_trips_path, args.mmsi_path)
+        stage.rows_out = len(trips_with_mmsi)
+    summary = summarize_trips(
+        args.path, trips_with_mmsi, jobs=args.jobs, telemetry=telemetry
+    )
+
+    with telemetry.stage("join", rows_in=len(summary)) as stage:
+        trips = read_table(args.f_trips_path, dtype=FISHING_TRIPS)
+        summary["trip_id"] = summary["trip_id"].astype(trips["trip_id"].dtype)
+        enriched = trips.merge(summary, on="trip_id", how="left")
+        # Trips without AIS data have no pings
+        enriched["ais_pings"] = enriched["ais_pings"].astype("Int64")
+        stage.rows_out = len(enriched)
+
+    with telemetry.stage("write", rows_in=len(enriched)):
+        enriched.to_csv(args.target_csv, index=False)
+        write_arrow(enriched, arrow_path(args.target_csv))
+
+    print(f"Summarized {len(summary)} of {len(trips)} trips")
+    telemetry.print_summary()
+    telemetry.write_report()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Summarizes the marked AIS data of each fishing trip,\
+        and adds the summaries to the fishing trips."
+    )
+    parser.add_argument("path", help="Directory containing marked AIS data")
+    parser.add_argument(
+        "f_trips_path", help="Path to fishing trips data from process_fishing_trips.py"
+    )
+    parser.add_argument(
+        "target_csv",
+        help="Path to csv file where the enriched trips are stored. The trips\
+        are also stored in an Arrow file next to it.",
+    )
+    parser.add_argument(
+        "--mmsi_path",
+        help="Path to MMSI data in xlsx or csv format, to find the trips of pings",
+        required=True,
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=None, help="Number of processes"
+    )
+    add_telemetry_arguments(parser)
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,62 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(__file__)), "scripts"))
+
+from trip_summary import summarize_file, summarize_trips  # noqa: E402
+
+MMSI = 257000000
+
+
+def write_days(path, pings: pd.DataFrame) -> None:
+    """
+    Writes pings as daily marked AIS files, with trip_id only set on the
+    day the trip departs, like process_ais does.
+    """
+    folder = os.path.join(path, "AIS_data_2020")
+    os.makedirs(folder)
+    for day, df in pings.groupby(pings["date_time_utc"].dt.date):
+        df = df.assign(trip_id=None)
+        df.to_parquet(os.path.join(folder, f"AIS_{day:%Y%m%d}.parquet"), index=False)
+
+
+def test_trip_spanning_several_days(tmp_path):
+    # Hourly pings from 1 January to 8 January, the trip is from
+    # 2 January 15:00 to 6 January 15:00
+    times = pd.date_range("2020-01-01", "2020-01-08", freq="h", inclusive="left")
+    n = len(times)
+    pings = pd.DataFrame(
+        {
+            "mmsi": MMSI,
+            "date_time_utc": times,
+            "lon": np.linspace(5.0, 15.0, n),
+            "lat": np.linspace(60.0, 70.0, n),
+            "sog": 10.0,
+            "fishing": np.arange(n) % 2 == 0,
+        }
+    )
+    trips = pd.DataFrame(
+        {
+            "Avgangstidspunkt": [pd.Timestamp("2020-01-02 15:00")],
+            "Ankomsttidspunkt": [pd.Timestamp("2020-01-06 15:00")],
+            "mmsi": [MMSI],
+            "trip_id": ["LK0013156300000"],
+        }
+    )
+    write_days(tmp_path, pings)
+    summary = summarize_trips(str(tmp_path), trips, jobs=1).set_index("trip_id")
+
+    # A single pass over all pings of the trip gives the expected values
+    one_file = tmp_path / "all.parquet"
+    pings.assign(trip_id=None).to_parquet(one_file, index=False)
+    expected, _ = summarize_file(str(one_file), trips)
+    expected = expected.set_index("trip_id")
+
+    trip = summary.loc["LK0013156300000"]
+    assert trip["ais_pings"] == 4 * 24 + 1
+    assert trip["fishing_hours"] + trip["steaming_hours"] == 4 * 24
+    for column in ["ais_pings", "distance_km", "fishing_hours", "steaming_hours"]:
+        assert np.isclose(trip[column], expected.loc["LK0013156300000", column])